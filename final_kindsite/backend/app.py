@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify, Response
+from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
 from supabase import create_client, Client
 import os
@@ -6,6 +6,14 @@ from openai import OpenAI
 import json
 from datetime import datetime
 import uuid
+from functools import lru_cache
+
+from auth import verify_locally, token_cache
+from prefs_cache import prefs_cache
+from write_behind import write_behind
+from sse import coalesce, HEARTBEAT
+from chat_context import context_store, website_section, build_chat_messages
+from pagination import fetch_page, page_limit, select_columns, iter_rows, export_chunks
 
 app = Flask(__name__)
 CORS(app, origins=["http://localhost:3000", "http://localhost:5173"], supports_credentials=True)
@@ -18,18 +26,36 @@ supabase: Client = create_client(supabase_url, supabase_key)
 # Initialize OpenAI client
 openai_client = OpenAI()
 
-def get_user_from_token(auth_header):
-    """Extract and verify user from Authorization header"""
+def get_user_from_token(auth_header, revalidate=False):
+    """Extract and verify user from Authorization header.
+
+    The JWT is verified locally and cached until it expires; Supabase Auth is only
+    called when it can't be checked locally or when revalidate=True (revocation checks).
+    """
     if not auth_header or not auth_header.startswith('Bearer '):
         return None
     
     token = auth_header.split(' ')[1]
+    if not revalidate:
+        user = token_cache.get(token)
+        if user is None:
+            user = verify_locally(token)
+            if user is not None:
+                token_cache.set(token, user)
+        if user is not None:
+            return user
+    
     try:
         user = supabase.auth.get_user(token)
-        return user.user if user else None
+        user = user.user if user else None
     except Exception as e:
         print(f"Auth error: {e}")
-        return None
+        user = None
+    if user is None:
+        token_cache.discard(token)
+    elif not revalidate:
+        token_cache.set(token, user)
+    return user
 
 @app.route('/api/health', methods=['GET'])
 def health_check():
@@ -88,11 +114,12 @@ def login():
 def logout():
     """User logout endpoint"""
     auth_header = request.headers.get('Authorization')
-    user = get_user_from_token(auth_header)
+    user = get_user_from_token(auth_header, revalidate=True)
     
     if not user:
         return jsonify({"success": False, "error": "Unauthorized"}), 401
     
+    token_cache.discard(auth_header.split(' ')[1])
     try:
         supabase.auth.sign_out()
         return jsonify({"success": True})
@@ -103,7 +130,7 @@ def logout():
 def get_current_user():
     """Get current authenticated user"""
     auth_header = request.headers.get('Authorization')
-    user = get_user_from_token(auth_header)
+    user = get_user_from_token(auth_header, revalidate=True)
     
     if not user:
         return jsonify({"success": False, "error": "Unauthorized"}), 401
@@ -119,6 +146,47 @@ def get_current_user():
 
 # ============= PREFERENCES ENDPOINTS =============
 
+def load_preferences(user_id):
+    """Return (preferences or None, etag), reading Supabase only on a cache miss"""
+    cached = prefs_cache.get(user_id)
+    if cached is not None:
+        return cached
+    
+    try:
+        response = supabase.table('user_preferences').select('*').eq('id', user_id).single().execute()
+        preferences = response.data
+    except Exception as e:
+        # PGRST116: no row yet -> cache the "no preferences" answer too
+        if getattr(e, 'code', None) != 'PGRST116':
+            return None, None
+        preferences = None
+    return preferences, prefs_cache.set(user_id, preferences)
+
+# (preference column, instruction line), in the order they appear in the prompt
+PREFERENCE_INSTRUCTIONS = (
+    ('dyslexia', "- Has dyslexia (e.g., dyslexia). Use clear, simple language with short sentences and paragraphs.\n"),
+    ('adhd', "- Prefers larger text. When providing formatted content, emphasize readability.\n"),
+    ('cognitive_impairment', "- Sensitive to motion. Avoid suggesting animated or moving content.\n"),
+    ('esl_simple_english', "- Prefers reduced motion in interfaces.\n"),
+    ('visual_impairment', "- Sensitive to bright colors. Suggest softer, more comfortable color palettes.\n"),
+)
+
+@lru_cache(maxsize=None)
+def _user_instructions_for_mask(mask):
+    user_instructions = "User's accessibility preferences:\n"
+    for bit, (_, line) in enumerate(PREFERENCE_INSTRUCTIONS):
+        if mask & (1 << bit):
+            user_instructions += line
+    return user_instructions
+
+def user_instructions_for(preferences):
+    """Build user instructions from preferences (memoized per preference bitmask)"""
+    mask = 0
+    for bit, (column, _) in enumerate(PREFERENCE_INSTRUCTIONS):
+        if preferences.get(column):
+            mask |= 1 << bit
+    return _user_instructions_for_mask(mask)
+
 @app.route('/api/preferences', methods=['GET'])
 def get_preferences():
     """Get user preferences"""
@@ -128,11 +196,13 @@ def get_preferences():
     if not user:
         return jsonify({"success": False, "error": "Unauthorized"}), 401
     
-    try:
-        response = supabase.table('user_preferences').select('*').eq('id', user.id).single().execute()
-        return jsonify({"success": True, "preferences": response.data})
-    except Exception as e:
-        return jsonify({"success": True, "preferences": None})
+    preferences, etag = load_preferences(user.id)
+    response = jsonify({"success": True, "preferences": preferences})
+    if etag:
+        # Lets the frontend send If-None-Match and get a 304 for unchanged prefs
+        response.set_etag(etag)
+        return response.make_conditional(request)
+    return response
 
 @app.route('/api/preferences', methods=['POST'])
 def save_preferences():
@@ -155,10 +225,22 @@ def save_preferences():
     
     try:
         response = supabase.table('user_preferences').upsert(preferences).execute()
-        return jsonify({"success": True, "preferences": response.data[0] if response.data else None})
     except Exception as e:
+        prefs_cache.discard(user.id)
         return jsonify({"success": False, "error": str(e)}), 400
 
+    saved = response.data[0] if response.data else None
+    # Write-through so the next read (and the next chat turn) skips Supabase
+    if saved is not None:
+        etag = prefs_cache.set(user.id, saved)
+    else:
+        prefs_cache.discard(user.id)
+        etag = None
+    result = jsonify({"success": True, "preferences": saved})
+    if etag:
+        result.set_etag(etag)
+    return result
+
 # ============= CHAT ENDPOINTS =============
 
 @app.route('/api/chat', methods=['POST'])
@@ -175,30 +257,11 @@ def chat():
     session_id = data.get('sessionId', str(uuid.uuid4()))
     website_data = data.get('websiteData')
     
-    # Get user preferences
-    try:
-        prefs_response = supabase.table('user_preferences').select('*').eq('id', user.id).single().execute()
-        preferences = prefs_response.data if prefs_response.data else {}
-    except:
-        preferences = {}
+    # Get user preferences (cached; see prefs_cache.py)
+    preferences, _ = load_preferences(user.id)
     
     # Build user instructions from preferences
-    user_instructions = "User's accessibility preferences:\n"
-    
-    if preferences.get('dyslexia'):
-        user_instructions += "- Has dyslexia (e.g., dyslexia). Use clear, simple language with short sentences and paragraphs.\n"
-    
-    if preferences.get('adhd'):
-        user_instructions += "- Prefers larger text. When providing formatted content, emphasize readability.\n"
-    
-    if preferences.get('cognitive_impairment'):
-        user_instructions += "- Sensitive to motion. Avoid suggesting animated or moving content.\n"
-    
-    if preferences.get('esl_simple_english'):
-        user_instructions += "- Prefers reduced motion in interfaces.\n"
-    
-    if preferences.get('visual_impairment'):
-        user_instructions += "- Sensitive to bright colors. Suggest softer, more comfortable color palettes.\n"
+    user_instructions = user_instructions_for(preferences or {})
     
     # Build system prompt
     system_prompt = f"""You are an accessibility assistant that helps convert inaccessible content (PDFs, images, documents, websites) into more accessible formats.
@@ -206,8 +269,11 @@ def chat():
 {user_instructions}
 """
     
-    if website_data:
-        system_prompt += f"\nWebsite data to analyze:\nURL: {website_data.get('url', 'N/A')}\nTitle: {website_data.get('title', 'N/A')}\nContent: {website_data.get('content', 'N/A')}\n"
+    # Rolling summary + website dedupe state for this session (see chat_context.py)
+    context = context_store.get(supabase, user.id, session_id)
+    
+    website_text, website_digest = website_section(website_data, context)
+    system_prompt += website_text
     
     system_prompt += """\nWhen the user uploads a document, image, or website:
 1. Analyze the content for accessibility issues
@@ -223,28 +289,19 @@ Be helpful, supportive, and focus on making content truly accessible for this us
         user_content = last_message.get('content', '')
         attachments = last_message.get('experimental_attachments')
         
-        try:
-            supabase.table('chat_messages').insert({
-                "user_id": user.id,
-                "role": "user",
-                "content": user_content,
-                "user_instructions": user_instructions,
-                "website_data": website_data,
-                "session_id": session_id,
-                "attachments": attachments
-            }).execute()
-        except Exception as e:
-            print(f"Error saving user message: {e}")
+        # Queued, not awaited: the model stream shouldn't wait on the database
+        write_behind.insert(supabase, 'chat_messages', {
+            "user_id": user.id,
+            "role": "user",
+            "content": user_content,
+            "user_instructions": user_instructions,
+            "website_data": website_data,
+            "session_id": session_id,
+            "attachments": attachments
+        })
     
-    # Convert messages to OpenAI format
-    openai_messages = [{"role": "system", "content": system_prompt}]
-    
-    for msg in messages:
-        role = msg.get('role')
-        content = msg.get('content', '')
-        
-        if role in ['user', 'assistant']:
-            openai_messages.append({"role": role, "content": content})
+    # Convert messages to OpenAI format: summary + recent turns within the token budget
+    openai_messages = build_chat_messages(system_prompt, messages, context)
     
     # Stream response from OpenAI
     def generate():
@@ -256,36 +313,60 @@ Be helpful, supportive, and focus on making content truly accessible for this us
                 max_tokens=2000
             )
             
-            full_response = ""
+            def deltas():
+                try:
+                    for chunk in stream:
+                        if chunk.choices and chunk.choices[0].delta.content:
+                            yield chunk.choices[0].delta.content
+                finally:
+                    stream.close()
+            
+            # Comment line first so proxies start passing bytes through immediately
+            yield ": stream-open\n\n"
+            
+            parts = []
+            for content in coalesce(deltas()):
+                if content is HEARTBEAT:
+                    yield ": keep-alive\n\n"
+                    continue
+                parts.append(content)
+                
+                # Send SSE format
+                yield f"data: {json.dumps({'type': 'text', 'content': content})}\n\n"
             
-            for chunk in stream:
-                if chunk.choices[0].delta.content:
-                    content = chunk.choices[0].delta.content
-                    full_response += content
-                    
-                    # Send SSE format
-                    yield f"data: {json.dumps({'type': 'text', 'content': content})}\n\n"
+            full_response = "".join(parts)
             
-            # Save assistant message to database
-            try:
-                supabase.table('chat_messages').insert({
-                    "user_id": user.id,
-                    "role": "assistant",
-                    "content": full_response,
-                    "user_instructions": user_instructions,
-                    "website_data": website_data,
-                    "reasoning_output": None,
-                    "session_id": session_id
-                }).execute()
-            except Exception as e:
-                print(f"Error saving assistant message: {e}")
+            # Save assistant message to database (write-behind)
+            write_behind.insert(supabase, 'chat_messages', {
+                "user_id": user.id,
+                "role": "assistant",
+                "content": full_response,
+                "user_instructions": user_instructions,
+                "website_data": website_data,
+                "reasoning_output": None,
+                "session_id": session_id
+            })
+            
+            context_store.after_turn(
+                openai_client, supabase, user.id, session_id,
+                messages + [{"role": "assistant", "content": full_response}],
+                context, website_digest
+            )
             
             yield f"data: {json.dumps({'type': 'done'})}\n\n"
             
         except Exception as e:
             yield f"data: {json.dumps({'type': 'error', 'error': str(e)})}\n\n"
     
-    return Response(generate(), mimetype='text/event-stream')
+    return Response(
+        generate(),
+        mimetype='text/event-stream',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# History returns these by default; large jsonb/text columns are opt-in via ?expand=
+MESSAGE_COLUMNS = 'id,role,content,created_at,session_id'
+MESSAGE_HEAVY_COLUMNS = ('website_data', 'attachments', 'user_instructions', 'reasoning_output', 'metadata')
 
 @app.route('/api/chat/history', methods=['GET'])
 def get_chat_history():
@@ -297,17 +378,54 @@ def get_chat_history():
         return jsonify({"success": False, "error": "Unauthorized"}), 401
     
     session_id = request.args.get('session_id')
+    columns = select_columns(MESSAGE_COLUMNS, MESSAGE_HEAVY_COLUMNS, request.args.get('expand'))
     
     try:
-        query = supabase.table('chat_messages').select('*').eq('user_id', user.id)
+        query = supabase.table('chat_messages').select(columns).eq('user_id', user.id)
         
         if session_id:
             query = query.eq('session_id', session_id)
         
-        response = query.order('created_at', desc=False).execute()
-        return jsonify({"success": True, "messages": response.data})
+        # Keyset pages on (created_at, id); pass next_cursor back as ?cursor=
+        messages, next_cursor = fetch_page(query, request.args.get('cursor'), page_limit(request.args.get('limit')))
+        return jsonify({"success": True, "messages": messages, "next_cursor": next_cursor})
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 400
 
+@app.route('/api/chat/history/export', methods=['GET'])
+def export_chat_history():
+    """Stream a user's full chat history as NDJSON (or ?format=json for one JSON array)"""
+    auth_header = request.headers.get('Authorization')
+    user = get_user_from_token(auth_header)
+    
+    if not user:
+        return jsonify({"success": False, "error": "Unauthorized"}), 401
+    
+    session_id = request.args.get('session_id')
+    columns = select_columns(MESSAGE_COLUMNS, MESSAGE_HEAVY_COLUMNS, request.args.get('expand'))
+    fmt = 'json' if request.args.get('format') == 'json' else 'ndjson'
+    
+    def make_query():
+        query = supabase.table('chat_messages').select(columns).eq('user_id', user.id)
+        if session_id:
+            query = query.eq('session_id', session_id)
+        return query
+    
+    # Pages through Supabase while writing, so memory stays at one page regardless of history size
+    def generate():
+        try:
+            yield from export_chunks(iter_rows(make_query), fmt)
+        except Exception as e:
+            print(f"Error exporting chat history: {e}")
+            if fmt == 'ndjson':
+                yield json.dumps({"error": str(e)}) + "\n"
+    
+    mimetype = 'application/json' if fmt == 'json' else 'application/x-ndjson'
+    return Response(
+        stream_with_context(generate()),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f"attachment; filename=chat-history.{fmt}"}
+    )
+
 if __name__ == '__main__':
     app.run(debug=True, port=5000)
@@ -0,0 +1,218 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from write_behind import utc_now
+
+# ================== CHAT CONTEXT WINDOW ==================
+# The client resends the whole conversation every turn. Instead of forwarding all
+# of it, the model gets: system prompt, a rolling summary of older turns (kept on
+# the chat_sessions row), the last CHAT_KEEP_MESSAGES messages verbatim, and the
+# website content only the first time it's seen in the session. Everything is
+# fitted to CHAT_CONTEXT_MAX_TOKENS so per-turn cost stays flat as the chat grows.
+# Summaries are refreshed after the reply has streamed, never on the request path.
+CHAT_KEEP_MESSAGES = int(os.environ.get("CHAT_KEEP_MESSAGES", "8"))
+CHAT_CONTEXT_MAX_TOKENS = int(os.environ.get("CHAT_CONTEXT_MAX_TOKENS", "12000"))
+CHAT_WEBSITE_MAX_TOKENS = int(os.environ.get("CHAT_WEBSITE_MAX_TOKENS", "6000"))
+CHAT_WEBSITE_RECALL_TOKENS = int(os.environ.get("CHAT_WEBSITE_RECALL_TOKENS", "500"))
+CHAT_SUMMARY_EVERY = int(os.environ.get("CHAT_SUMMARY_EVERY", "4"))  # unsummarized old messages before a refresh
+CHAT_SUMMARY_MAX_TOKENS = int(os.environ.get("CHAT_SUMMARY_MAX_TOKENS", "400"))
+CHAT_SUMMARY_MODEL = os.environ.get("CHAT_SUMMARY_MODEL", "gpt-4o-mini")
+CHAT_CONTEXT_CACHE_MAX = int(os.environ.get("CHAT_CONTEXT_CACHE_MAX", "5000"))
+
+SESSIONS_TABLE = "chat_sessions"
+
+SUMMARY_PROMPT = """Update the running summary of an accessibility-assistant conversation.
+Keep the user's goals, stated needs, documents or pages discussed, key facts from them, and any decisions or open questions.
+Write compact plain prose, at most {max_words} words. Return only the summary."""
+
+def estimate_tokens(s: str) -> int:
+    # ~4 chars/token for ASCII prose; non-ASCII (accents, CJK) tokenizes far denser
+    extra = len(s.encode("utf-8")) - len(s)
+    return (len(s) + 3) // 4 + extra // 2
+
+def clamp_tokens(s: str, max_tokens: int) -> str:
+    if max_tokens <= 0:
+        return ""
+    if estimate_tokens(s) <= max_tokens:
+        return s
+    # Character cut is approximate for non-ASCII; it only needs to land under budget
+    cut = s[:max_tokens * 4]
+    while cut and estimate_tokens(cut) > max_tokens:
+        cut = cut[:int(len(cut) * 0.9)]
+    return cut.rstrip() + " …"
+
+def website_hash(website_data) -> str:
+    if not website_data:
+        return ""
+    blob = f"{website_data.get('url', '')}\n{website_data.get('content', '')}"
+    return hashlib.sha1(blob.encode("utf-8")).hexdigest()[:20]
+
+def _turns(messages: list) -> list:
+    return [{"role": m.get('role'), "content": m.get('content') or ''}
+            for m in messages if m.get('role') in ('user', 'assistant')]
+
+def _empty_context():
+    return {"summary": "", "summarized_messages": 0, "website_hashes": []}
+
+class SessionContextStore:
+    """
+    Per-session summary state: in-process LRU in front of the chat_sessions table.
+    sessionId comes from the client, so state is keyed on (user_id, session_id).
+    """
+
+    def __init__(self, max_entries: int = CHAT_CONTEXT_CACHE_MAX):
+        self.max_entries = max_entries
+        self._data = OrderedDict()  # (user_id, session_id) -> context dict
+        self._lock = threading.Lock()
+        self._refreshing = set()  # (user_id, session_id)
+        self._pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="chat-summary")
+        self.stats = {"hits": 0, "misses": 0, "summaries": 0, "errors": 0}
+
+    def get(self, client, user_id: str, session_id: str) -> dict:
+        key = (user_id, session_id)
+        with self._lock:
+            ctx = self._data.get(key)
+            if ctx is not None:
+                self._data.move_to_end(key)
+                self.stats["hits"] += 1
+                return dict(ctx)
+            self.stats["misses"] += 1
+        ctx = _empty_context()
+        try:
+            rows = client.table(SESSIONS_TABLE).select(
+                'summary,summarized_messages,website_hashes'
+            ).eq('user_id', user_id).eq('session_id', session_id).limit(1).execute().data
+            if rows:
+                ctx.update({k: v for k, v in rows[0].items() if v is not None})
+        except Exception as e:
+            print(f"Chat context load failed for {session_id}: {e}")
+        self._put(key, ctx)
+        return dict(ctx)
+
+    def after_turn(self, openai_client, client, user_id: str, session_id: str, messages: list,
+                   ctx: dict, sent_hash: str = "") -> None:
+        """
+        Record what this turn sent and, if enough old messages piled up outside the
+        verbatim window, fold them into the summary. Runs on a background thread.
+        """
+        key = (user_id, session_id)
+        messages = _turns(messages)
+        changed = False
+        if sent_hash and sent_hash not in ctx["website_hashes"]:
+            ctx = {**ctx, "website_hashes": (ctx["website_hashes"] + [sent_hash])[-20:]}
+            changed = True
+        older = len(messages) - CHAT_KEEP_MESSAGES
+        # A shorter history than the summary covers means the client started over
+        summarized = ctx["summarized_messages"] if ctx["summarized_messages"] <= len(messages) else 0
+        wants_summary = older - summarized >= CHAT_SUMMARY_EVERY
+        if not (changed or wants_summary):
+            return
+        self._put(key, ctx)
+
+        with self._lock:
+            if key in self._refreshing:
+                wants_summary = False
+                if not changed:
+                    return
+            elif wants_summary:
+                self._refreshing.add(key)
+        self._pool.submit(self._refresh, openai_client, client, user_id, session_id,
+                          messages[:older] if wants_summary else None, ctx)
+
+    def _refresh(self, openai_client, client, user_id, session_id, older, ctx) -> None:
+        key = (user_id, session_id)
+        try:
+            if older is not None:
+                start = ctx["summarized_messages"] if ctx["summarized_messages"] <= len(older) else 0
+                summary = summarize(openai_client, ctx["summary"] if start else "", older[start:])
+                with self._lock:
+                    current = self._data.get(key, ctx)
+                ctx = {**current, "summary": summary, "summarized_messages": len(older)}
+                self._put(key, ctx)
+                self.stats["summaries"] += 1
+            client.table(SESSIONS_TABLE).upsert({
+                "session_id": session_id,
+                "user_id": user_id,
+                "summary": ctx["summary"],
+                "summarized_messages": ctx["summarized_messages"],
+                "website_hashes": ctx["website_hashes"],
+                "updated_at": utc_now(),
+            }, on_conflict="user_id,session_id").execute()
+        except Exception as e:
+            self.stats["errors"] += 1
+            print(f"Chat context refresh failed for {session_id}: {e}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def _put(self, key, ctx) -> None:
+        with self._lock:
+            self._data[key] = dict(ctx)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+def summarize(openai_client, previous: str, messages: list) -> str:
+    transcript = "\n".join(
+        f"{m.get('role')}: {clamp_tokens(m.get('content') or '', 1000)}" for m in messages
+    )
+    user = f"Current summary:\n{previous or '(none)'}\n\nNew messages:\n{transcript}"
+    resp = openai_client.chat.completions.create(
+        model=CHAT_SUMMARY_MODEL,
+        messages=[
+            {"role": "system", "content": SUMMARY_PROMPT.format(max_words=int(CHAT_SUMMARY_MAX_TOKENS * 0.75))},
+            {"role": "user", "content": user},
+        ],
+        max_tokens=CHAT_SUMMARY_MAX_TOKENS,
+    )
+    return (resp.choices[0].message.content or "").strip()
+
+def website_section(website_data, ctx: dict) -> tuple[str, str]:
+    """Returns (prompt text, content hash). Content already sent this session is recalled as a short excerpt."""
+    if not website_data:
+        return "", ""
+    digest = website_hash(website_data)
+    content = website_data.get('content') or 'N/A'
+    if digest in ctx["website_hashes"]:
+        label = "Content (already shared earlier in this conversation; excerpt)"
+        content = clamp_tokens(content, CHAT_WEBSITE_RECALL_TOKENS)
+    else:
+        label = "Content"
+        content = clamp_tokens(content, CHAT_WEBSITE_MAX_TOKENS)
+    text = (f"\nWebsite data to analyze:\nURL: {website_data.get('url', 'N/A')}\n"
+            f"Title: {website_data.get('title', 'N/A')}\n{label}: {content}\n")
+    return text, digest
+
+def build_chat_messages(system_prompt: str, messages: list, ctx: dict,
+                        max_tokens: int = CHAT_CONTEXT_MAX_TOKENS) -> list:
+    """
+    OpenAI messages for this turn within max_tokens: system prompt, rolling summary,
+    then the newest turns back to the verbatim window (older unsummarized ones only if they fit).
+    """
+    turns = _turns(messages)
+    summarized = ctx["summarized_messages"] if ctx["summarized_messages"] <= len(turns) else 0
+    summary = ctx["summary"] if summarized else ""
+
+    head = [{"role": "system", "content": system_prompt}]
+    if summary:
+        head.append({"role": "system", "content": f"Summary of the earlier conversation:\n{summary}"})
+    budget = max_tokens - sum(estimate_tokens(m["content"]) + 4 for m in head)
+
+    # Newest first; the current user message always goes in, clamped if it alone overflows
+    kept = []
+    for i in range(len(turns) - 1, summarized - 1, -1):
+        msg = turns[i]
+        cost = estimate_tokens(msg["content"]) + 4
+        if not kept:
+            msg = {**msg, "content": clamp_tokens(msg["content"], max(budget - 4, 256))}
+            cost = estimate_tokens(msg["content"]) + 4
+        elif cost > budget:
+            break
+        kept.append(msg)
+        budget -= cost
+    return head + kept[::-1]
+
+context_store = SessionContextStore()
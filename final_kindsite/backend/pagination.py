@@ -0,0 +1,87 @@
+import os
+import re
+import json
+import base64
+
+# ================== KEYSET PAGINATION ==================
+# Pages are ordered by (created_at, id) and continue from an opaque cursor holding
+# the last row's pair, so page N costs the same as page 1 (no OFFSET scans).
+HISTORY_PAGE_SIZE = int(os.environ.get("HISTORY_PAGE_SIZE", "100"))
+HISTORY_MAX_PAGE_SIZE = int(os.environ.get("HISTORY_MAX_PAGE_SIZE", "500"))
+HISTORY_EXPORT_PAGE_SIZE = int(os.environ.get("HISTORY_EXPORT_PAGE_SIZE", "1000"))
+
+# Cursor values are interpolated into a PostgREST filter, so only accept the
+# shapes we emit: ISO timestamps and uuids.
+_TIMESTAMP_RE = re.compile(r"^[0-9T:.+\- ]{10,40}$")
+_ID_RE = re.compile(r"^[0-9a-fA-F-]{1,64}$")
+
+def encode_cursor(row: dict) -> str:
+    raw = json.dumps([row["created_at"], row["id"]], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str):
+    """Returns (created_at, id); raises ValueError on a malformed cursor."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except Exception:
+        raise ValueError("invalid cursor")
+    if not isinstance(created_at, str) or not isinstance(row_id, str) \
+            or not _TIMESTAMP_RE.match(created_at) or not _ID_RE.match(row_id):
+        raise ValueError("invalid cursor")
+    return created_at, row_id
+
+def page_limit(value) -> int:
+    try:
+        limit = int(value) if value is not None else HISTORY_PAGE_SIZE
+    except (TypeError, ValueError):
+        limit = HISTORY_PAGE_SIZE
+    return max(1, min(limit, HISTORY_MAX_PAGE_SIZE))
+
+def select_columns(base: str, heavy: tuple, expand) -> str:
+    """Explicit projection; heavy columns only when listed in ?expand=a,b."""
+    wanted = {c.strip() for c in (expand or "").split(",") if c.strip()}
+    extra = [c for c in heavy if c in wanted]
+    return ",".join([base] + extra)
+
+def fetch_page(query, cursor, limit: int):
+    """
+    Apply the keyset condition and ordering to a PostgREST query and run it.
+    Returns (rows, next_cursor or None).
+    """
+    if cursor:
+        created_at, row_id = decode_cursor(cursor)
+        query = query.or_(
+            f'created_at.gt."{created_at}",and(created_at.eq."{created_at}",id.gt.{row_id})'
+        )
+    # one extra row tells us whether another page exists
+    rows = query.order('created_at', desc=False).order('id', desc=False).limit(limit + 1).execute().data or []
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, encode_cursor(rows[-1])
+    return rows, None
+
+def iter_rows(make_query, page_size: int = HISTORY_EXPORT_PAGE_SIZE):
+    """
+    Yield every row, one keyset page at a time. make_query() must return a fresh
+    query builder each call (builders accumulate filters in place).
+    """
+    cursor = None
+    while True:
+        rows, cursor = fetch_page(make_query(), cursor, page_size)
+        yield from rows
+        if not cursor:
+            return
+
+def export_chunks(rows, fmt: str):
+    """Serialize rows incrementally as NDJSON (default) or a single JSON array."""
+    if fmt == "json":
+        yield "["
+        first = True
+        for row in rows:
+            yield ("" if first else ",") + json.dumps(row)
+            first = False
+        yield "]"
+        return
+    for row in rows:
+        yield json.dumps(row) + "\n"
@@ -0,0 +1,93 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+
+# ================== PREFERENCES CACHE ==================
+# Per-user cache of the user_preferences row. save_preferences writes through, so
+# the process that handled the save never serves stale prefs. With the shared
+# SQLite store (PREFS_CACHE_DB) it is the source of truth for every worker: each
+# get reads the row's etag there and the in-process copy only saves re-parsing it.
+# Without it, other workers see a save after PREFS_CACHE_TTL_SEC.
+PREFS_CACHE_MAX = int(os.environ.get("PREFS_CACHE_MAX", "10000"))
+PREFS_CACHE_TTL = int(os.environ.get("PREFS_CACHE_TTL_SEC", "300"))
+PREFS_CACHE_DB = os.environ.get("PREFS_CACHE_DB", "")  # empty = in-process only
+
+def prefs_etag(prefs) -> str:
+    blob = json.dumps(prefs, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha1(blob.encode("utf-8")).hexdigest()[:20]
+
+class PreferencesCache:
+    def __init__(self, max_entries: int = PREFS_CACHE_MAX, ttl: int = PREFS_CACHE_TTL, db_path: str = PREFS_CACHE_DB):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()  # user_id -> (expires, prefs, etag)
+        self._lock = threading.Lock()
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS prefs (user_id TEXT PRIMARY KEY, prefs TEXT, etag TEXT, expires REAL)"
+            )
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id: str):
+        """Returns (prefs, etag) or None on a miss. prefs may be None (user has no row yet)."""
+        now = time.time()
+        with self._lock:
+            entry = self._data.get(user_id)
+            if self._db is not None:
+                return self._get_shared(user_id, entry, now)
+            if entry and entry[0] > now:
+                self._data.move_to_end(user_id)
+                self.hits += 1
+                return entry[1], entry[2]
+            if entry:
+                del self._data[user_id]
+            self.misses += 1
+            return None
+
+    def _get_shared(self, user_id, entry, now):
+        # caller holds self._lock; another worker may have saved or discarded since we cached
+        row = self._db.execute(
+            "SELECT prefs, etag, expires FROM prefs WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        if not row or row[2] <= now:
+            self._data.pop(user_id, None)
+            self.misses += 1
+            return None
+        prefs = entry[1] if entry and entry[2] == row[1] else json.loads(row[0])
+        self._put(user_id, prefs, row[1], row[2])
+        self.hits += 1
+        return prefs, row[1]
+
+    def set(self, user_id: str, prefs) -> str:
+        etag = prefs_etag(prefs)
+        expires = time.time() + self.ttl
+        with self._lock:
+            self._put(user_id, prefs, etag, expires)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO prefs (user_id, prefs, etag, expires) VALUES (?, ?, ?, ?)",
+                    (user_id, json.dumps(prefs, default=str), etag, expires),
+                )
+        return etag
+
+    def discard(self, user_id: str) -> None:
+        with self._lock:
+            self._data.pop(user_id, None)
+            if self._db is not None:
+                self._db.execute("DELETE FROM prefs WHERE user_id = ?", (user_id,))
+
+    def _put(self, user_id, prefs, etag, expires) -> None:
+        self._data[user_id] = (expires, prefs, etag)
+        self._data.move_to_end(user_id)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+prefs_cache = PreferencesCache()
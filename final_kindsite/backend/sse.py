@@ -0,0 +1,82 @@
+import os
+import time
+import queue
+import threading
+
+# ================== SSE CHUNK COALESCING ==================
+# The model emits a delta every few tokens; writing each as its own SSE frame
+# means thousands of tiny writes/flushes per reply. Deltas are batched until
+# SSE_COALESCE_BYTES or SSE_COALESCE_MS is reached, and an SSE comment is sent
+# every SSE_HEARTBEAT_SEC of silence so proxies don't buffer or drop the stream.
+SSE_COALESCE_BYTES = int(os.environ.get("SSE_COALESCE_BYTES", "256"))
+SSE_COALESCE_MS = int(os.environ.get("SSE_COALESCE_MS", "50"))
+SSE_HEARTBEAT_SEC = float(os.environ.get("SSE_HEARTBEAT_SEC", "15"))
+
+HEARTBEAT = object()
+_DONE = object()
+
+def coalesce(deltas, max_bytes=SSE_COALESCE_BYTES, max_ms=SSE_COALESCE_MS, heartbeat_sec=SSE_HEARTBEAT_SEC):
+    """
+    Yield batched text from the `deltas` iterator, or HEARTBEAT after a quiet period.
+    The iterator is drained on a helper thread so timers fire while the model is silent;
+    closing this generator (client disconnect) stops the helper at the next delta.
+    """
+    q = queue.Queue()
+    stop = threading.Event()
+
+    def pump():
+        try:
+            for delta in deltas:
+                if stop.is_set():
+                    break
+                q.put(delta)
+        except Exception as e:
+            q.put(e)
+        finally:
+            close = getattr(deltas, "close", None)
+            if stop.is_set() and close:
+                close()
+            q.put(_DONE)
+
+    threading.Thread(target=pump, name="sse-pump", daemon=True).start()
+
+    buf, size = [], 0
+    first_at = None
+    last_sent = time.monotonic()
+    window = max_ms / 1000.0
+    try:
+        while True:
+            now = time.monotonic()
+            if buf:
+                timeout = max(first_at + window - now, 0)
+            else:
+                timeout = max(last_sent + heartbeat_sec - now, 0)
+            try:
+                item = q.get(timeout=timeout)
+            except queue.Empty:
+                if buf:
+                    yield "".join(buf)
+                    buf, size = [], 0
+                else:
+                    yield HEARTBEAT
+                last_sent = time.monotonic()
+                continue
+
+            if item is _DONE:
+                break
+            if isinstance(item, Exception):
+                if buf:
+                    yield "".join(buf)
+                raise item
+            if not buf:
+                first_at = time.monotonic()
+            buf.append(item)
+            size += len(item)
+            if size >= max_bytes or max_ms <= 0:
+                yield "".join(buf)
+                buf, size = [], 0
+                last_sent = time.monotonic()
+        if buf:
+            yield "".join(buf)
+    finally:
+        stop.set()
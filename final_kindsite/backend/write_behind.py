@@ -0,0 +1,119 @@
+import os
+import time
+import uuid
+import atexit
+import threading
+from datetime import datetime, timezone
+
+# ================== WRITE-BEHIND PERSISTENCE ==================
+# Chat writes don't need to finish before the model starts streaming. Requests
+# enqueue rows here and return; a background thread batches them into bulk
+# upserts and retries failures with backoff. Rows get their id when queued and
+# are written with ON CONFLICT (id) DO NOTHING, so re-sending a batch whose
+# first attempt actually committed can't duplicate messages. A batch the
+# database rejects for its data is bisected so only the bad rows are retried;
+# a transport failure (timeout, outage, 5xx) requeues the batch as a whole.
+WRITE_BEHIND_FLUSH_SEC = float(os.environ.get("WRITE_BEHIND_FLUSH_SEC", "0.25"))
+WRITE_BEHIND_BATCH = int(os.environ.get("WRITE_BEHIND_BATCH", "200"))
+WRITE_BEHIND_MAX_RETRIES = int(os.environ.get("WRITE_BEHIND_MAX_RETRIES", "5"))
+
+def utc_now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+def _rejected_rows(exc) -> bool:
+    """
+    True if PostgREST rejected the data itself (bad value, constraint, RLS check),
+    which only some rows of a batch may cause. SQLSTATE classes 22/23 and 42501;
+    non-JSON error pages carry the HTTP status as their code instead.
+    """
+    code = str(getattr(exc, "code", "") or "")
+    return code[:2] in ("22", "23") or code == "42501"
+
+class WriteBehindQueue:
+    def __init__(self, flush_sec: float = WRITE_BEHIND_FLUSH_SEC, batch: int = WRITE_BEHIND_BATCH,
+                 max_retries: int = WRITE_BEHIND_MAX_RETRIES):
+        self.flush_sec = flush_sec
+        self.batch = batch
+        self.max_retries = max_retries
+        self._cond = threading.Condition()
+        self._inserts = []   # (client, table, row, attempts, not_before)
+        self._thread = None
+        self.stats = {"queued": 0, "written": 0, "retried": 0, "dropped": 0}
+
+    def insert(self, client, table: str, row: dict) -> None:
+        """
+        Queue a row insert. created_at is stamped now so batching can't reorder messages,
+        and id so a retried write is idempotent.
+        """
+        row = dict(row)
+        row.setdefault("id", str(uuid.uuid4()))
+        row.setdefault("created_at", utc_now())
+        with self._cond:
+            self._inserts.append((client, table, row, 0, 0.0))
+            self.stats["queued"] += 1
+            self._start()
+            if len(self._inserts) >= self.batch:
+                self._cond.notify()
+
+    def flush(self) -> None:
+        """Write everything that is due now (used by the worker and at exit)."""
+        with self._cond:
+            now = time.monotonic()
+            inserts = [op for op in self._inserts if op[4] <= now]
+            self._inserts = [op for op in self._inserts if op[4] > now]
+
+        # Bulk write per (client, table, column set); PostgREST wants uniform rows
+        groups = {}
+        for client, table, row, attempts, _ in inserts:
+            groups.setdefault((id(client), table, tuple(sorted(row))), (client, table, []))[2].append((row, attempts))
+        for client, table, items in groups.values():
+            self._insert_batch(client, table, items)
+
+    def _insert_batch(self, client, table, items) -> None:
+        try:
+            client.table(table).upsert(
+                [row for row, _ in items], on_conflict="id", ignore_duplicates=True
+            ).execute()
+            self._count("written", len(items))
+        except Exception as e:
+            if len(items) > 1 and _rejected_rows(e):
+                mid = len(items) // 2
+                self._insert_batch(client, table, items[:mid])
+                self._insert_batch(client, table, items[mid:])
+                return
+            print(f"Write-behind insert of {len(items)} row(s) into {table} failed: {e}")
+            for row, attempts in items:
+                self._retry_insert(client, table, row, attempts)
+
+    def _retry_insert(self, client, table, row, attempts) -> None:
+        if attempts + 1 > self.max_retries:
+            self._count("dropped", 1)
+            return
+        with self._cond:
+            self._inserts.append((client, table, row, attempts + 1, self._backoff(attempts)))
+            self.stats["retried"] += 1
+
+    def _backoff(self, attempts: int) -> float:
+        return time.monotonic() + min(0.5 * (2 ** attempts), 30.0)
+
+    def _count(self, key: str, n: int) -> None:
+        with self._cond:
+            self.stats[key] += n
+
+    def _start(self) -> None:
+        # caller holds self._cond
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                self._cond.wait(timeout=self.flush_sec)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Write-behind flush error: {e}")
+
+write_behind = WriteBehindQueue()
+atexit.register(write_behind.flush)
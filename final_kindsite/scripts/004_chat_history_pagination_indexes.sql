@@ -0,0 +1,27 @@
+-- Composite indexes for keyset (cursor) pagination of chat history.
+-- The API pages with: where <filter> and (created_at, id) > (:cursor_ts, :cursor_id)
+--                     order by created_at, id limit :n
+-- so each filter column leads an index ending in (created_at, id).
+
+create index if not exists chat_messages_user_created_id_idx
+  on public.chat_messages(user_id, created_at, id);
+
+create index if not exists chat_messages_session_created_id_idx
+  on public.chat_messages(session_id, created_at, id);
+
+-- Conversation-scoped listing (only where chat_messages.conversation_id exists)
+do $$
+begin
+  if exists (
+    select 1 from information_schema.columns
+    where table_schema = 'public' and table_name = 'chat_messages' and column_name = 'conversation_id'
+  ) then
+    create index if not exists chat_messages_conversation_created_id_idx
+      on public.chat_messages(conversation_id, created_at, id);
+  end if;
+end;
+$$;
+
+-- Superseded by the composite indexes above
+drop index if exists public.chat_messages_user_id_idx;
+drop index if exists public.idx_chat_messages_session_id;
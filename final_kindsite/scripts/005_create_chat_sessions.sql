@@ -0,0 +1,34 @@
+-- Per-session context state for the chat endpoint: a rolling summary of the
+-- messages that fell out of the verbatim window, how many messages it covers,
+-- and hashes of website content already sent to the model in this session.
+create table if not exists public.chat_sessions (
+  session_id uuid not null,
+  user_id uuid references auth.users(id) on delete cascade not null,
+  summary text not null default '',
+  summarized_messages integer not null default 0,
+  website_hashes text[] not null default '{}',
+  updated_at timestamp with time zone default timezone('utc'::text, now()) not null,
+  -- session ids come from the client, so a session only exists within its user
+  primary key (user_id, session_id)
+);
+
+-- Enable Row Level Security
+alter table public.chat_sessions enable row level security;
+
+create policy "users_can_view_own_sessions"
+  on public.chat_sessions for select
+  using (auth.uid() = user_id);
+
+create policy "users_can_insert_own_sessions"
+  on public.chat_sessions for insert
+  with check (auth.uid() = user_id);
+
+create policy "users_can_update_own_sessions"
+  on public.chat_sessions for update
+  using (auth.uid() = user_id);
+
+create policy "users_can_delete_own_sessions"
+  on public.chat_sessions for delete
+  using (auth.uid() = user_id);
+
+create index if not exists chat_sessions_user_id_idx on public.chat_sessions(user_id);
@@ -370,16 +370,28 @@
 # if __name__ == '__main__':
 #     app.run(debug=True, port=5000)
 
-from flask import Flask, request, jsonify, Response
+from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
 from supabase import create_client, Client
 import os
 import json
 from datetime import datetime
 import uuid
-import requests
+import hashlib
+import tempfile
 from pathlib import Path
 
+from auth import verify_locally, token_cache
+from clients import user_clients
+from prefs_cache import prefs_cache
+from pagination import fetch_page, page_limit, select_columns, iter_rows, export_chunks
+from pdf_jobs import pdf_jobs, public_view, QueueFull, FINISHED
+from pdf_cache import pdf_cache, cache_key
+from upload_stream import StreamedUpload, UploadTooLarge, BadUpload, PDF_MAX_UPLOAD_BYTES, encode_multipart, iter_file, new_boundary, ReplayableChunks
+from upstream import upstream, UpstreamBusy
+from integration import IntegrationLoader
+from balancer import BalancerRegistry
+
 app = Flask(__name__)
 CORS(app, origins=["http://localhost:3000", "http://localhost:5173"], supports_credentials=True)
 
@@ -388,43 +400,64 @@ SUPABASE_URL = os.environ.get("NEXT_PUBLIC_SUPABASE_URL")
 SUPABASE_ANON_KEY = os.environ.get("NEXT_PUBLIC_SUPABASE_ANON_KEY")
 supabase: Client = create_client(SUPABASE_URL, SUPABASE_ANON_KEY)
 
-def user_client(jwt: str) -> Client:
-    client = create_client(SUPABASE_URL, SUPABASE_ANON_KEY)
-    client.postgrest.auth(jwt)
-    return client
+def user_client(jwt: str, user_id: str) -> Client:
+    """RLS-scoped client for this user, reused across requests (see clients.py)."""
+    return user_clients.get(user_id, jwt)
 
 # ================== INTEGRATION JSON (Gemini proxy) ==================
+# Compiled once and hot-reloaded when the file changes (see integration.py).
+# ACCESSIBLE_SERVER_URL (comma-separated for several workers), when set, overrides the spec's servers.
 INTEGRATION_PATH = Path(__file__).parent / "integrations" / "accessible_pdf_post.json"
-try:
-    with open(INTEGRATION_PATH, "r", encoding="utf-8") as f:
-        ACCESSIBLE_CFG = json.load(f)
-except FileNotFoundError:
-    ACCESSIBLE_CFG = {
-        "server": os.getenv("ACCESSIBLE_SERVER_URL", "https://kindsite-1.onrender.com"),
-        "request": {"url": "/process"},
-        "response": {"map": {"summary_markdown": "modified_content", "accessible_pdf_url": "pdf_url"}}
-    }
-
-UPSTREAM_BASE = os.getenv("ACCESSIBLE_SERVER_URL", ACCESSIBLE_CFG.get("server", "https://kindsite-1.onrender.com"))
-
-def _map_response(payload: dict, mapping: dict) -> dict:
-    out = {}
-    for new_key, old_key in mapping.items():
-        out[new_key] = payload.get(old_key)
-    return out
+accessible_pdf = IntegrationLoader(INTEGRATION_PATH, fallback={
+    "server": "https://kindsite-1.onrender.com",
+    "request": {
+        "url": "/process",
+        "fields": [
+            {"name": "accessibility_preset", "type": "string", "value": "cognitive_impairment"},
+            {"name": "file_input", "type": "file"}
+        ]
+    },
+    "response": {"map": {"summary_markdown": "modified_content", "accessible_pdf_url": "pdf_url"}}
+}, server_env="ACCESSIBLE_SERVER_URL")
+
+balancers = BalancerRegistry()  # least-outstanding routing over the spec's servers
+
+PDF_UPSTREAM_TIMEOUT = int(os.getenv("PDF_UPSTREAM_TIMEOUT_SEC", "120"))
+PDF_JOB_HEARTBEAT_SEC = float(os.getenv("PDF_JOB_HEARTBEAT_SEC", "15"))
+GEMINI_CHAT_STREAM = os.getenv("GEMINI_CHAT_STREAM", "true").lower() == "true"
 
 # ================== AUTH HELPERS ==================
-def get_user_from_token(auth_header):
-    """Extract and verify user from Authorization header using Supabase Auth."""
+def get_user_from_token(auth_header, revalidate=False):
+    """
+    Extract and verify user from Authorization header.
+    Verifies the JWT locally (cached until it expires); falls back to Supabase Auth when
+    the token can't be checked locally, or when revalidate=True (revocation-sensitive calls).
+    """
     if not auth_header or not auth_header.startswith('Bearer '):
         return None, None
     token = auth_header.split(' ', 1)[1]
+
+    if not revalidate:
+        user = token_cache.get(token)
+        if user is None:
+            user = verify_locally(token)
+            if user is not None:
+                token_cache.set(token, user)
+        if user is not None:
+            return user, token
+
     try:
         user = supabase.auth.get_user(token)
-        return (user.user if user else None), token
+        user = user.user if user else None
     except Exception as e:
         print(f"Auth error: {e}")
+        user = None
+    if user is None:
+        token_cache.discard(token)
         return None, None
+    if not revalidate:
+        token_cache.set(token, user)
+    return user, token
 
 # ================== HEALTH ==================
 @app.route('/api/health', methods=['GET'])
@@ -477,9 +510,11 @@ def login():
 @app.route('/api/auth/logout', methods=['POST'])
 def logout():
     auth_header = request.headers.get('Authorization')
-    user, _ = get_user_from_token(auth_header)
+    user, token = get_user_from_token(auth_header, revalidate=True)
     if not user:
         return jsonify({"success": False, "error": "Unauthorized"}), 401
+    token_cache.discard(token)
+    user_clients.discard(user.id)
     try:
         supabase.auth.sign_out()
         return jsonify({"success": True})
@@ -489,7 +524,7 @@ def logout():
 @app.route('/api/auth/user', methods=['GET'])
 def get_current_user():
     auth_header = request.headers.get('Authorization')
-    user, _ = get_user_from_token(auth_header)
+    user, _ = get_user_from_token(auth_header, revalidate=True)
     if not user:
         return jsonify({"success": False, "error": "Unauthorized"}), 401
     return jsonify({
@@ -502,6 +537,22 @@ def get_current_user():
     })
 
 # ================== PREFERENCES (RLS via user_client) ==================
+def load_preferences(user_id, token):
+    """Return (preferences or None, etag), reading Supabase only on a cache miss."""
+    cached = prefs_cache.get(user_id)
+    if cached is not None:
+        return cached
+    db = user_client(token, user_id)
+    try:
+        response = db.table('user_preferences').select('*').eq('id', user_id).single().execute()
+        preferences = response.data
+    except Exception as e:
+        # PGRST116: no row yet -> cache the "no preferences" answer too
+        if getattr(e, 'code', None) != 'PGRST116':
+            return None, None
+        preferences = None
+    return preferences, prefs_cache.set(user_id, preferences)
+
 @app.route('/api/preferences', methods=['GET'])
 def get_preferences():
     auth_header = request.headers.get('Authorization')
@@ -509,12 +560,13 @@ def get_preferences():
     if not user:
         return jsonify({"success": False, "error": "Unauthorized"}), 401
 
-    db = user_client(token)
-    try:
-        response = db.table('user_preferences').select('*').eq('id', user.id).single().execute()
-        return jsonify({"success": True, "preferences": response.data})
-    except Exception:
-        return jsonify({"success": True, "preferences": None})
+    preferences, etag = load_preferences(user.id, token)
+    response = jsonify({"success": True, "preferences": preferences})
+    if etag:
+        # Lets the frontend send If-None-Match and get a 304 for unchanged prefs
+        response.set_etag(etag)
+        return response.make_conditional(request)
+    return response
 
 @app.route('/api/preferences', methods=['POST'])
 def save_preferences():
@@ -523,7 +575,7 @@ def save_preferences():
     if not user:
         return jsonify({"success": False, "error": "Unauthorized"}), 401
 
-    db = user_client(token)
+    db = user_client(token, user.id)
     data = request.json or {}
     preferences = {
         "id": user.id,
@@ -536,11 +588,30 @@ def save_preferences():
 
     try:
         response = db.table('user_preferences').upsert(preferences).execute()
-        return jsonify({"success": True, "preferences": response.data[0] if response.data else None})
     except Exception as e:
+        prefs_cache.discard(user.id)
         return jsonify({"success": False, "error": str(e)}), 400
 
+    saved = response.data[0] if response.data else None
+    # Write-through so the next read skips Supabase
+    if saved is not None:
+        etag = prefs_cache.set(user.id, saved)
+    else:
+        prefs_cache.discard(user.id)
+        etag = None
+    result = jsonify({"success": True, "preferences": saved})
+    if etag:
+        result.set_etag(etag)
+    return result
+
 # ================== CONVERSATIONS ==================
+# Message list endpoints return these by default; large jsonb/text columns are opt-in via ?expand=
+# (conversation_id only exists where the conversations schema is deployed, so only
+# the conversation-scoped listing asks for it)
+MESSAGE_COLUMNS = 'id,role,content,created_at,session_id'
+CONVERSATION_MESSAGE_COLUMNS = f'{MESSAGE_COLUMNS},conversation_id'
+MESSAGE_HEAVY_COLUMNS = ('website_data', 'attachments', 'user_instructions', 'reasoning_output', 'metadata')
+
 @app.get('/api/conversations')
 def list_conversations():
     auth_header = request.headers.get('Authorization')
@@ -548,7 +619,7 @@ def list_conversations():
     if not user:
         return jsonify({"success": False, "error": "Unauthorized"}), 401
 
-    db = user_client(token)
+    db = user_client(token, user.id)
     resp = db.table('chat_conversations') \
              .select('id,title,created_at,updated_at') \
              .eq('user_id', user.id) \
@@ -563,7 +634,7 @@ def create_conversation():
     if not user:
         return jsonify({"success": False, "error": "Unauthorized"}), 401
 
-    db = user_client(token)
+    db = user_client(token, user.id)
     title = (request.json or {}).get('title') or 'New conversation'
     resp = db.table('chat_conversations') \
              .insert({"user_id": user.id, "title": title}) \
@@ -579,19 +650,60 @@ def list_messages(cid):
     if not user:
         return jsonify({"success": False, "error": "Unauthorized"}), 401
 
-    db = user_client(token)
+    db = user_client(token, user.id)
     conv = db.table('chat_conversations').select('id').eq('id', cid).eq('user_id', user.id).single().execute()
     if not conv.data:
         return jsonify({"success": False, "error": "Not found"}), 404
 
-    msgs = db.table('chat_messages') \
-             .select('id,role,content,created_at') \
-             .eq('conversation_id', cid) \
-             .order('created_at', desc=False) \
-             .execute()
-    return jsonify({"success": True, "messages": msgs.data})
+    columns = select_columns(CONVERSATION_MESSAGE_COLUMNS, MESSAGE_HEAVY_COLUMNS, request.args.get('expand'))
+    query = db.table('chat_messages').select(columns).eq('conversation_id', cid)
+    try:
+        msgs, next_cursor = fetch_page(query, request.args.get('cursor'), page_limit(request.args.get('limit')))
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    return jsonify({"success": True, "messages": msgs, "next_cursor": next_cursor})
 
 # ================== PDF ACCESSIBILITY PROXY (Gemini worker) ==================
+def _convert_pdf(chunks, sha256: str, filename: str, mimetype: str, form, progress=None) -> dict:
+    """
+    Stream one PDF to the upstream worker; returns the mapped response. Raises on upstream failure.
+    chunks is a callable returning a fresh iterator of the file's bytes (so a retry can re-send
+    them) and sha256 their digest; form is the client's text fields. A cached conversion for
+    (sha256, upstream fields) is returned without contacting the upstream (see pdf_cache.py).
+    """
+    spec = accessible_pdf.current()  # one spec for the whole call, even if it reloads meanwhile
+    fields = spec.build_fields(form)
+    key = cache_key(sha256, fields)
+    cached = pdf_cache.get(key)
+    if cached is not None:
+        return spec.map_response(cached)
+
+    boundary = new_boundary()
+
+    def build_body():
+        return encode_multipart(spec.file_field or "file_input", filename, mimetype, chunks(), fields, boundary)[1]
+
+    if progress:
+        progress("converting")
+    # A conversion has no side effects, so it's safe to retry whenever the body can be rebuilt
+    pick, observe = balancers.get(spec.servers, spec.balancing).route(spec.path)
+    r = upstream.request(
+        spec.method,
+        pick,
+        observer=observe,
+        body_factory=build_body,
+        idempotent=True,
+        headers={"Content-Type": f"multipart/form-data; boundary={boundary}"},
+        timeout=PDF_UPSTREAM_TIMEOUT,
+    )
+    r.raise_for_status()
+    upstream_json = r.json()  # expects { modified_content, pdf_url }
+    pdf_cache.set(key, upstream_json)
+    return spec.map_response(upstream_json)
+
+def _wants_job() -> bool:
+    return request.args.get("mode") == "job" or "respond-async" in request.headers.get("Prefer", "")
+
 @app.post("/api/accessible/from-chat")
 def accessible_from_chat():
     """
@@ -600,50 +712,155 @@ def accessible_from_chat():
       - accessibility_preset (optional; defaults from JSON or 'cognitive_impairment')
     Proxies it to the Render API (Gemini worker) and returns:
       { success, summary_markdown, accessible_pdf_url }
+    With ?mode=job (or Prefer: respond-async) it returns 202 { success, job_id, status_url, events_url }
+    right away and the conversion runs on the local job pool (see pdf_jobs.py); an upload that
+    was already converted with the same preset gets the synchronous 200 response instead.
     """
     # Optional auth (uncomment if you want to protect it):
     # auth_header = request.headers.get('Authorization')
     # user, _ = get_user_from_token(auth_header)
     # if not user: return jsonify({"success": False, "error": "Unauthorized"}), 401
 
-    cfg = ACCESSIBLE_CFG
-    req_cfg = cfg.get("request", {})
-    resp_cfg = cfg.get("response", {"map": {"summary_markdown": "modified_content", "accessible_pdf_url": "pdf_url"}})
-    mapping = resp_cfg.get("map", {"summary_markdown": "modified_content", "accessible_pdf_url": "pdf_url"})
+    # Reject oversized uploads before reading a byte; chunked bodies are capped while streaming
+    if request.content_length and request.content_length > PDF_MAX_UPLOAD_BYTES:
+        return jsonify({"success": False, "error": f"File too large (max {PDF_MAX_UPLOAD_BYTES} bytes)"}), 413
 
+    # Read the multipart body as a stream; request.files would spool the whole upload first.
     # support "file" OR "file_input"
-    f = request.files.get("file") or request.files.get("file_input")
-    if not f:
+    try:
+        upload = StreamedUpload(request.stream, request.headers.get("Content-Type", ""))
+        has_file = upload.open()
+    except UploadTooLarge as e:
+        return jsonify({"success": False, "error": str(e)}), 413
+    except BadUpload as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    if not has_file:
         return jsonify({"success": False, "error": "No file provided (expected 'file' or 'file_input')"}), 400
 
-    # preset default from JSON
-    preset_default = "cognitive_impairment"
-    for fld in req_cfg.get("fields", []):
-        if fld.get("name") == "accessibility_preset":
-            preset_default = fld.get("value", preset_default)
-            break
-    preset = request.form.get("accessibility_preset", preset_default)
-
-    upstream_url = f'{UPSTREAM_BASE}{req_cfg.get("url", "/process")}'
-    files = {"file_input": (f.filename, f.stream, f.mimetype or "application/pdf")}
-    data = {"accessibility_preset": preset}
-
+    # Fields may follow the file in the body, so upload.form is only read once the file has been
+    # spooled; defaults (e.g. accessibility_preset) come from the integration JSON
+    if _wants_job():
+        # The request body is gone once we return, so the job works from a spooled copy
+        fd, path = tempfile.mkstemp(prefix="kindsite-pdf-", suffix=".pdf")
+        digest = hashlib.sha256()
+        try:
+            with os.fdopen(fd, "wb") as out:
+                for chunk in upload.chunks():
+                    digest.update(chunk)
+                    out.write(chunk)
+        except (UploadTooLarge, BadUpload) as e:
+            os.unlink(path)
+            return jsonify({"success": False, "error": str(e)}), 413 if isinstance(e, UploadTooLarge) else 400
+        job_form = dict(upload.form)
+
+        # Already converted: answer like the synchronous endpoint, no job needed
+        spec = accessible_pdf.current()
+        cached = pdf_cache.get(cache_key(digest.hexdigest(), spec.build_fields(job_form)))
+        if cached is not None:
+            os.unlink(path)
+            return jsonify({"success": True, **spec.map_response(cached)})
+
+        def run(progress):
+            return _convert_pdf(lambda: iter_file(path), digest.hexdigest(), upload.filename, upload.mimetype,
+                                job_form, progress)
+
+        try:
+            job = pdf_jobs.submit(run, cleanup=lambda: os.unlink(path))
+        except QueueFull as e:
+            os.unlink(path)
+            return jsonify({"success": False, "error": f"Too many conversions in progress: {e}"}), 503
+        return jsonify({
+            "success": True,
+            "job_id": job["id"],
+            "status_url": f"/api/accessible/jobs/{job['id']}",
+            "events_url": f"/api/accessible/jobs/{job['id']}/events",
+        }), 202
+
+    # Spool the upload to disk while hashing it, so a repeat upload is answered from the
+    # cache before the upstream is contacted; retries re-send the spooled copy
+    replay = ReplayableChunks(upload.chunks())
     try:
-        r = requests.post(upstream_url, files=files, data=data, timeout=120)
-        r.raise_for_status()
-        upstream = r.json()  # expects { modified_content, pdf_url }
+        digest = hashlib.sha256()
+        for chunk in replay():
+            digest.update(chunk)
+        mapped = _convert_pdf(replay, digest.hexdigest(), upload.filename, upload.mimetype, upload.form)
+    except UploadTooLarge as e:
+        return jsonify({"success": False, "error": str(e)}), 413
+    except BadUpload as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    except UpstreamBusy as e:
+        return jsonify({"success": False, "error": str(e)}), 503
     except Exception as e:
         return jsonify({"success": False, "error": f"Upstream error: {e}"}), 502
-
-    mapped = _map_response(upstream, mapping)
+    finally:
+        replay.close()
     return jsonify({"success": True, **mapped})
 
+@app.get("/api/accessible/metrics")
+def accessible_metrics():
+    return jsonify({
+        "cache": pdf_cache.stats(),
+        "jobs": {**pdf_jobs.stats, "pending": pdf_jobs.pending()},
+        "upstreams": upstream.stats(),
+        "integration": {"servers": accessible_pdf.current().servers, "reloads": accessible_pdf.reloads, "errors": accessible_pdf.errors},
+        "balancer": balancers.stats(),
+    })
+
+@app.get("/api/accessible/jobs/<job_id>")
+def accessible_job_status(job_id):
+    job = pdf_jobs.get(job_id)
+    if not job:
+        return jsonify({"success": False, "error": "Not found"}), 404
+    return jsonify({"success": True, "job": public_view(job)})
+
+@app.get("/api/accessible/jobs/<job_id>/result")
+def accessible_job_result(job_id):
+    """Same shape as the synchronous endpoint once done; 202 while pending."""
+    job = pdf_jobs.get(job_id)
+    if not job:
+        return jsonify({"success": False, "error": "Not found"}), 404
+    if job["status"] == "done":
+        return jsonify({"success": True, **job["result"]})
+    if job["status"] == "error":
+        return jsonify({"success": False, "error": f"Upstream error: {job['error']}"}), 502
+    return jsonify({"success": True, "job": public_view(job)}), 202
+
+@app.get("/api/accessible/jobs/<job_id>/events")
+def accessible_job_events(job_id):
+    """SSE: one `data:` event per job update, ending after done/error."""
+    job = pdf_jobs.get(job_id)
+    if not job:
+        return jsonify({"success": False, "error": "Not found"}), 404
+
+    def generate():
+        current = job
+        while True:
+            yield f"data: {json.dumps(public_view(current))}\n\n"
+            if current["status"] in FINISHED:
+                return
+            version = current["version"]
+            while True:
+                current = pdf_jobs.wait(job_id, version, PDF_JOB_HEARTBEAT_SEC)
+                if current is None:
+                    return
+                if current["version"] != version:
+                    break
+                yield ": keep-alive\n\n"
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 # ================== CHAT (neutral stub; forward to Gemini chat if provided) ==================
 @app.route('/api/chat', methods=['POST'])
 def chat():
     """
     No OpenAI. If you have a Gemini chat endpoint, set GEMINI_CHAT_URL and we forward the JSON.
     Otherwise 501 so the frontend doesn't pretend to stream.
+    The upstream reply (SSE, chunked or plain JSON) is relayed byte-for-byte as it arrives,
+    unless GEMINI_CHAT_STREAM=false.
     """
     GEMINI_CHAT_URL = os.getenv("GEMINI_CHAT_URL")
     data = request.json or {}
@@ -657,13 +874,46 @@ def chat():
     if auth_header:
         headers['Authorization'] = auth_header
 
+    if request.headers.get('Accept'):
+        headers['Accept'] = request.headers['Accept']
+
+    if not GEMINI_CHAT_STREAM:
+        try:
+            # A chat generation isn't idempotent: only re-sent if the request never went out
+            r = upstream.post(GEMINI_CHAT_URL, json=data, headers=headers, timeout=120)
+            r.raise_for_status()
+            return jsonify(r.json())
+        except Exception as e:
+            return jsonify({"success": False, "error": f"Upstream chat error: {e}"}), 502
+
+    r = None
     try:
-        r = requests.post(GEMINI_CHAT_URL, json=data, headers=headers, timeout=120)
+        r = upstream.post(GEMINI_CHAT_URL, json=data, headers=headers, timeout=120, stream=True)
         r.raise_for_status()
-        return jsonify(r.json())
     except Exception as e:
+        if r is not None:
+            r.close()
         return jsonify({"success": False, "error": f"Upstream chat error: {e}"}), 502
 
+    # Pull-based: the next upstream read only happens once the client has taken the last
+    # chunk, and a client disconnect closes this generator, which drops the upstream connection
+    def relay():
+        try:
+            for chunk in r.iter_content(chunk_size=None):
+                if chunk:
+                    yield chunk
+        except Exception as e:
+            print(f"Upstream chat stream error: {e}")
+        finally:
+            r.close()
+
+    return Response(
+        stream_with_context(relay()),
+        status=r.status_code,
+        content_type=r.headers.get('Content-Type', 'application/json'),
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 # ================== (Legacy) Session-scoped history ==================
 @app.route('/api/chat/history', methods=['GET'])
 def get_chat_history():
@@ -672,17 +922,53 @@ def get_chat_history():
     if not user:
         return jsonify({"success": False, "error": "Unauthorized"}), 401
 
-    db = user_client(token)
+    db = user_client(token, user.id)
     session_id = request.args.get('session_id')
+    columns = select_columns(MESSAGE_COLUMNS, MESSAGE_HEAVY_COLUMNS, request.args.get('expand'))
     try:
-        query = db.table('chat_messages').select('*').eq('user_id', user.id)
+        query = db.table('chat_messages').select(columns).eq('user_id', user.id)
         if session_id:
             query = query.eq('session_id', session_id)
-        response = query.order('created_at', desc=False).execute()
-        return jsonify({"success": True, "messages": response.data})
+        messages, next_cursor = fetch_page(query, request.args.get('cursor'), page_limit(request.args.get('limit')))
+        return jsonify({"success": True, "messages": messages, "next_cursor": next_cursor})
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 400
 
+@app.get('/api/chat/history/export')
+def export_chat_history():
+    """Stream the user's full history as NDJSON (or ?format=json for one JSON array)."""
+    auth_header = request.headers.get('Authorization')
+    user, token = get_user_from_token(auth_header)
+    if not user:
+        return jsonify({"success": False, "error": "Unauthorized"}), 401
+
+    db = user_client(token, user.id)
+    session_id = request.args.get('session_id')
+    columns = select_columns(MESSAGE_COLUMNS, MESSAGE_HEAVY_COLUMNS, request.args.get('expand'))
+    fmt = 'json' if request.args.get('format') == 'json' else 'ndjson'
+
+    def make_query():
+        query = db.table('chat_messages').select(columns).eq('user_id', user.id)
+        if session_id:
+            query = query.eq('session_id', session_id)
+        return query
+
+    # Pages through Supabase while writing, so memory stays at one page regardless of history size
+    def generate():
+        try:
+            yield from export_chunks(iter_rows(make_query), fmt)
+        except Exception as e:
+            print(f"Error exporting chat history: {e}")
+            if fmt == 'ndjson':
+                yield json.dumps({"error": str(e)}) + "\n"
+
+    mimetype = 'application/json' if fmt == 'json' else 'application/x-ndjson'
+    return Response(
+        stream_with_context(generate()),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f"attachment; filename=chat-history.{fmt}"}
+    )
+
 # ================== MAIN ==================
 if __name__ == '__main__':
     # Optional: override upstreams via env
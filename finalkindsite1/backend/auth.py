@@ -0,0 +1,96 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from types import SimpleNamespace
+
+import jwt
+
+# ================== LOCAL JWT VERIFICATION ==================
+# Supabase access tokens are JWTs signed with the project's JWT secret (HS256) or,
+# on projects with asymmetric signing keys, a key published at the JWKS endpoint.
+# Verifying them here saves an Auth round-trip per request; only revocation-sensitive
+# endpoints (logout, /api/auth/user) still ask Supabase.
+SUPABASE_URL = os.environ.get("NEXT_PUBLIC_SUPABASE_URL")
+SUPABASE_JWT_SECRET = os.environ.get("SUPABASE_JWT_SECRET")
+JWT_AUDIENCE = os.environ.get("SUPABASE_JWT_AUDIENCE", "authenticated")
+AUTH_CACHE_MAX = int(os.environ.get("AUTH_CACHE_MAX", "10000"))
+AUTH_CACHE_TTL = int(os.environ.get("AUTH_CACHE_TTL_SEC", "300"))
+
+_jwks_client = jwt.PyJWKClient(f"{SUPABASE_URL}/auth/v1/.well-known/jwks.json", cache_keys=True) if SUPABASE_URL else None
+
+def _user_from_claims(claims: dict):
+    # Same attribute shape the endpoints read off supabase's User model
+    return SimpleNamespace(
+        id=claims.get("sub"),
+        email=claims.get("email"),
+        role=claims.get("role"),
+        created_at=None,  # not in the JWT; /api/auth/user fetches it remotely
+        claims=claims,
+    )
+
+def verify_locally(token: str):
+    """Return a user for a validly signed, unexpired token; None if it can't be verified here."""
+    try:
+        alg = jwt.get_unverified_header(token).get("alg")
+        if alg == "HS256":
+            if not SUPABASE_JWT_SECRET:
+                return None
+            key = SUPABASE_JWT_SECRET
+        elif alg in ("RS256", "ES256") and _jwks_client:
+            key = _jwks_client.get_signing_key_from_jwt(token).key
+        else:
+            return None
+        claims = jwt.decode(token, key, algorithms=[alg], audience=JWT_AUDIENCE)
+    except jwt.PyJWTError:
+        return None
+    except Exception as e:
+        print(f"Local auth error: {e}")
+        return None
+    return _user_from_claims(claims) if claims.get("sub") else None
+
+def _token_expiry(token: str) -> float:
+    try:
+        return float(jwt.decode(token, options={"verify_signature": False}).get("exp", 0))
+    except Exception:
+        return 0.0
+
+class TokenCache:
+    """Bounded LRU of token -> user; entries never outlive the token's own exp."""
+
+    def __init__(self, max_entries: int = AUTH_CACHE_MAX, ttl: int = AUTH_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token: str):
+        now = time.time()
+        with self._lock:
+            entry = self._data.get(token)
+            if entry and entry[0] > now:
+                self._data.move_to_end(token)
+                self.hits += 1
+                return entry[1]
+            if entry:
+                del self._data[token]
+            self.misses += 1
+            return None
+
+    def set(self, token: str, user) -> None:
+        expires = min(time.time() + self.ttl, _token_expiry(token))
+        if expires <= time.time():
+            return
+        with self._lock:
+            self._data[token] = (expires, user)
+            self._data.move_to_end(token)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def discard(self, token: str) -> None:
+        with self._lock:
+            self._data.pop(token, None)
+
+token_cache = TokenCache()
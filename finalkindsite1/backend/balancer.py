@@ -0,0 +1,169 @@
+import json
+import time
+import threading
+
+import requests
+
+# ================== UPSTREAM LOAD BALANCING ==================
+# The PDF integration can list several worker servers. Each call goes to the
+# worker with the fewest requests in flight (ties: lowest latency EWMA).
+# Consecutive failures eject a worker for a while; a background probe hits its
+# health path, re-admits it once it answers, and also keeps idle workers warm.
+# Probes need the same run of consecutive failures to eject (a cold start can
+# outlast one probe timeout). With a single server there's nothing to fail over
+# to, so the prober only runs if probe_interval_sec is set explicitly.
+# Configured by the "balancing" block of the integration JSON.
+DEFAULTS = {
+    "health_path": "/",
+    "probe_interval_sec": 15,
+    "probe_timeout_sec": 5,
+    "eject_after_failures": 3,
+    "eject_sec": 30,
+    "ewma_alpha": 0.3,
+}
+
+class _Backend:
+    def __init__(self, base: str):
+        self.base = base
+        self.outstanding = 0
+        self.ewma_ms = None
+        self.failures = 0  # consecutive, on the request path
+        self.probe_failures = 0  # consecutive
+        self.ejected_until = 0.0
+        self.stats = {"requests": 0, "errors": 0, "ejections": 0, "readmissions": 0}
+
+    def available(self, now: float) -> bool:
+        return self.ejected_until <= now
+
+class Balancer:
+    def __init__(self, servers: list, config: dict = None):
+        if not servers:
+            raise ValueError("Balancer needs at least one server")
+        self.config = {**DEFAULTS, **(config or {})}
+        self._backends = [_Backend(s.rstrip("/")) for s in servers]
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        probing = len(self._backends) > 1 or "probe_interval_sec" in (config or {})
+        if probing and self.config["probe_interval_sec"] > 0:
+            self._thread = threading.Thread(target=self._probe_loop, name="upstream-probe", daemon=True)
+            self._thread.start()
+
+    def route(self, path: str):
+        """
+        Returns (pick, observe) for UpstreamClient.request: pick() chooses a worker per
+        attempt and returns its URL; observe(url, ok, elapsed) settles that attempt.
+        """
+        picked = {}
+
+        def pick() -> str:
+            # A retry goes to a worker this call hasn't tried yet, if there is one
+            backend = self._choose(exclude=set(picked.values()))
+            url = f"{backend.base}{path}"
+            picked[url] = backend
+            return url
+
+        def observe(url: str, ok, elapsed: float) -> None:
+            backend = picked.get(url)
+            if backend is not None:
+                self._settle(backend, ok, elapsed)
+
+        return pick, observe
+
+    def stats(self) -> list:
+        now = time.time()
+        with self._lock:
+            return [{
+                "server": b.base,
+                "outstanding": b.outstanding,
+                "ewma_ms": round(b.ewma_ms, 1) if b.ewma_ms is not None else None,
+                "ejected": not b.available(now),
+                **b.stats,
+            } for b in self._backends]
+
+    def close(self) -> None:
+        self._stop.set()
+
+    def _choose(self, exclude=()) -> _Backend:
+        now = time.time()
+        with self._lock:
+            candidates = [b for b in self._backends if b.available(now)]
+            candidates = [b for b in candidates if b not in exclude] or candidates
+            if candidates:
+                # Unmeasured workers count as fastest so they get tried
+                backend = min(candidates, key=lambda b: (b.outstanding, b.ewma_ms or 0.0))
+            else:
+                # Everyone is ejected: fail open to whoever comes back first
+                backend = min(self._backends, key=lambda b: b.ejected_until)
+            backend.outstanding += 1
+            backend.stats["requests"] += 1
+            return backend
+
+    def _settle(self, backend: _Backend, ok, elapsed: float) -> None:
+        """ok=None: the attempt ended for reasons that say nothing about the worker."""
+        with self._lock:
+            backend.outstanding -= 1
+            if ok is None:
+                return
+            if ok:
+                alpha = self.config["ewma_alpha"]
+                ms = elapsed * 1000
+                backend.ewma_ms = ms if backend.ewma_ms is None else alpha * ms + (1 - alpha) * backend.ewma_ms
+                backend.failures = 0
+                return
+            backend.stats["errors"] += 1
+            backend.failures += 1
+            if backend.failures >= self.config["eject_after_failures"] and backend.available(time.time()):
+                self._eject(backend)
+
+    def _eject(self, backend: _Backend) -> None:
+        # caller holds self._lock
+        backend.ejected_until = time.time() + self.config["eject_sec"]
+        backend.stats["ejections"] += 1
+
+    def _probe_loop(self) -> None:
+        session = requests.Session()
+        while not self._stop.wait(self.config["probe_interval_sec"]):
+            for backend in self._backends:
+                try:
+                    r = session.get(f"{backend.base}{self.config['health_path']}", timeout=self.config["probe_timeout_sec"])
+                    r.close()
+                    # Any answer but a gateway error means the worker is up (even a 404 or 405)
+                    alive = r.status_code not in (502, 503, 504)
+                except requests.RequestException:
+                    alive = False
+                with self._lock:
+                    if alive:
+                        backend.probe_failures = 0
+                        if not backend.available(time.time()):
+                            backend.ejected_until = 0.0
+                            backend.failures = 0
+                            backend.stats["readmissions"] += 1
+                        continue
+                    backend.probe_failures += 1
+                    if (backend.probe_failures >= self.config["eject_after_failures"]
+                            and backend.available(time.time())):
+                        self._eject(backend)
+        session.close()
+
+class BalancerRegistry:
+    """One Balancer per (servers, config); a hot-reloaded spec with new servers gets a fresh one."""
+
+    def __init__(self):
+        self._current = None
+        self._key = None
+        self._lock = threading.Lock()
+
+    def get(self, servers: list, config: dict) -> Balancer:
+        key = (tuple(servers), json.dumps(config or {}, sort_keys=True))
+        with self._lock:
+            if key != self._key:
+                if self._current is not None:
+                    self._current.close()
+                self._current = Balancer(servers, config)
+                self._key = key
+            return self._current
+
+    def stats(self) -> list:
+        with self._lock:
+            return self._current.stats() if self._current else []
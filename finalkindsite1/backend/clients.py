@@ -0,0 +1,71 @@
+import os
+import threading
+from collections import OrderedDict
+
+from supabase import create_client, Client, ClientOptions
+
+# ================== PER-USER SUPABASE CLIENTS ==================
+# create_client builds fresh auth/PostgREST/storage sub-clients and an HTTP
+# connection pool every time. Keep one client per user (bounded LRU) and only
+# swap the Authorization header when that user's token changes. Evicted or
+# discarded clients are only dropped, never closed: a request that already holds
+# one may still be using it, and GC closes its connections once it's released.
+SUPABASE_URL = os.environ.get("NEXT_PUBLIC_SUPABASE_URL")
+SUPABASE_ANON_KEY = os.environ.get("NEXT_PUBLIC_SUPABASE_ANON_KEY")
+USER_CLIENT_CACHE_MAX = int(os.environ.get("USER_CLIENT_CACHE_MAX", "256"))
+
+# Server-side clients never hold a session, so skip the refresh timer/storage
+_OPTIONS = ClientOptions(auto_refresh_token=False, persist_session=False)
+
+class UserClientPool:
+    def __init__(self, max_entries: int = USER_CLIENT_CACHE_MAX):
+        self.max_entries = max_entries
+        self._clients = OrderedDict()  # user_id -> [jwt, Client]
+        self._lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+        self.reauthed = 0
+
+    def get(self, user_id: str, jwt: str) -> Client:
+        with self._lock:
+            entry = self._clients.get(user_id)
+            if entry is not None:
+                self._clients.move_to_end(user_id)
+                if entry[0] != jwt:
+                    entry[1].postgrest.auth(jwt)
+                    entry[0] = jwt
+                    self.reauthed += 1
+                else:
+                    self.reused += 1
+                return entry[1]
+
+        client = create_client(SUPABASE_URL, SUPABASE_ANON_KEY, options=_OPTIONS)
+        client.postgrest.auth(jwt)
+        with self._lock:
+            if user_id in self._clients:
+                # another thread built one concurrently; keep the first (ours was never handed out)
+                _close(client)
+                return self._clients[user_id][1]
+            self.created += 1
+            self._clients[user_id] = [jwt, client]
+            self._clients.move_to_end(user_id)
+            while len(self._clients) > self.max_entries:
+                self._clients.popitem(last=False)
+        return client
+
+    def discard(self, user_id: str) -> None:
+        with self._lock:
+            self._clients.pop(user_id, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"clients": len(self._clients), "created": self.created,
+                    "reused": self.reused, "reauthed": self.reauthed}
+
+def _close(client: Client) -> None:
+    try:
+        client.postgrest.session.close()
+    except Exception:
+        pass
+
+user_clients = UserClientPool()
@@ -0,0 +1,212 @@
+import os
+import re
+import json
+import time
+import threading
+from pathlib import Path
+
+# ================== INTEGRATION SPECS ==================
+# integrations/*.json describe an upstream call: where it goes (one or more
+# servers, see balancer.py), which form fields it takes (defaults, types) and
+# how its JSON reply maps onto ours.
+# Specs are compiled once into a request builder and a response mapper, so
+# requests don't walk the JSON. The file is re-checked every
+# INTEGRATION_RELOAD_SEC and a changed spec replaces the compiled one in a
+# single reference swap; a broken edit is logged and the last good spec stays.
+INTEGRATION_RELOAD_SEC = float(os.getenv("INTEGRATION_RELOAD_SEC", "2"))
+
+class SpecError(ValueError):
+    pass
+
+_MISSING = object()
+_PATH_RE = re.compile(r"([^.\[\]]+)|\[(\d+)\]")
+
+def _compile_path(path: str):
+    """'a.b[0].c' -> ('a', 'b', 0, 'c')"""
+    if not isinstance(path, str) or not path:
+        raise SpecError(f"Invalid path: {path!r}")
+    steps = []
+    pos = 0
+    for m in _PATH_RE.finditer(path):
+        gap = path[pos:m.start()]
+        if gap not in ("", "."):
+            raise SpecError(f"Invalid path: {path!r}")
+        steps.append(m.group(1) if m.group(1) is not None else int(m.group(2)))
+        pos = m.end()
+    if pos != len(path):
+        raise SpecError(f"Invalid path: {path!r}")
+    return tuple(steps)
+
+def _get(payload, steps):
+    for step in steps:
+        if isinstance(step, int):
+            if not isinstance(payload, list) or step >= len(payload):
+                return _MISSING
+            payload = payload[step]
+        else:
+            if not isinstance(payload, dict) or step not in payload:
+                return _MISSING
+            payload = payload[step]
+    return payload
+
+def _set(out: dict, steps, value) -> None:
+    for step in steps[:-1]:
+        out = out.setdefault(step, {})
+    out[steps[-1]] = value
+
+def _to_bool(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "yes", "on")
+    return bool(value)
+
+_COERCE = {
+    "string": lambda v: v if isinstance(v, str) else json.dumps(v) if isinstance(v, (dict, list)) else str(v),
+    "int": lambda v: int(float(v)) if isinstance(v, str) else int(v),
+    "float": float,
+    "bool": _to_bool,
+    "json": lambda v: v,
+}
+
+def _coercer(type_name: str):
+    if type_name not in _COERCE:
+        raise SpecError(f"Unknown type: {type_name!r}")
+    coerce = _COERCE[type_name]
+
+    def apply(value):
+        try:
+            return coerce(value)
+        except (TypeError, ValueError):
+            return None
+    return apply
+
+class Integration:
+    """A compiled spec. Immutable once built, so it can be swapped under live requests."""
+
+    def __init__(self, spec: dict, server_override: str = None):
+        if not isinstance(spec, dict):
+            raise SpecError("Spec must be a JSON object")
+        req = spec.get("request", {})
+        resp = spec.get("response", {})
+        self.name = spec.get("name", "integration")
+        # "servers" lists interchangeable workers; a comma-separated override replaces them
+        if server_override:
+            servers = [s.strip() for s in server_override.split(",") if s.strip()]
+        else:
+            servers = spec.get("servers") or [spec.get("server", "")]
+        if not isinstance(servers, list) or not all(isinstance(s, str) and s for s in servers):
+            raise SpecError("servers must be a non-empty list of URLs")
+        self.servers = [s.rstrip("/") for s in servers]
+        self.server = self.servers[0]
+        self.balancing = spec.get("balancing", {})
+        if not isinstance(self.balancing, dict):
+            raise SpecError("balancing must be an object")
+        self.method = req.get("method", "POST").upper()
+        self.path = req.get("url", "/")
+        self.url = f"{self.server}{self.path}"
+        self.spec = spec
+
+        self.file_field = None
+        self._fields = []  # (name, source key, default, coerce)
+        for fld in req.get("fields", []):
+            name = fld.get("name")
+            if not name:
+                raise SpecError("Every request field needs a name")
+            if fld.get("type") == "file":
+                self.file_field = name
+                continue
+            source = fld.get("from", f"form.{name}")
+            if source.startswith("form."):
+                source = source[len("form."):]
+            self._fields.append((name, source, fld.get("value"), _coercer(fld.get("type", "string"))))
+
+        self._map = []  # (dest steps, source steps, default, coerce)
+        for dest, rule in resp.get("map", {}).items():
+            if isinstance(rule, str):
+                rule = {"path": rule}
+            coerce = _coercer(rule["type"]) if "type" in rule else None
+            self._map.append((_compile_path(dest), _compile_path(rule.get("path", dest)), rule.get("default"), coerce))
+
+    def default(self, name: str):
+        for field_name, _, default, _ in self._fields:
+            if field_name == name:
+                return default
+        return None
+
+    def build_fields(self, form: dict) -> dict:
+        """Upstream text fields from the client's form, with spec defaults and types applied."""
+        out = {}
+        for name, source, default, coerce in self._fields:
+            value = form.get(source, default)
+            if value is None:
+                continue
+            out[name] = coerce(value)
+        return out
+
+    def map_response(self, payload) -> dict:
+        out = {}
+        for dest, source, default, coerce in self._map:
+            value = _get(payload, source)
+            if value is _MISSING or value is None:
+                value = default
+            elif coerce:
+                value = coerce(value)
+            _set(out, dest, value)
+        return out
+
+class IntegrationLoader:
+    """Serves the compiled spec for one file, recompiling when the file changes."""
+
+    def __init__(self, path, fallback: dict, server_env: str = None, reload_sec: float = INTEGRATION_RELOAD_SEC):
+        self.path = Path(path)
+        self.fallback = fallback
+        self.server_env = server_env
+        self.reload_sec = reload_sec
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._checked = 0.0
+        self.reloads = 0
+        self.errors = 0
+        self._current = self._load(initial=True)
+
+    def current(self) -> Integration:
+        now = time.monotonic()
+        if now - self._checked >= self.reload_sec and self._lock.acquire(blocking=False):
+            # One request does the stat; the rest keep using the compiled spec
+            try:
+                self._checked = now
+                if self._stat() != self._mtime:
+                    self._current = self._load()
+            finally:
+                self._lock.release()
+        return self._current
+
+    def _stat(self):
+        try:
+            st = self.path.stat()
+            return (st.st_mtime_ns, st.st_size)
+        except FileNotFoundError:
+            return None
+
+    def _load(self, initial: bool = False) -> Integration:
+        mtime = self._stat()
+        override = os.getenv(self.server_env) if self.server_env else None
+        try:
+            if mtime is None:
+                spec = self.fallback
+            else:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    spec = json.load(f)
+            compiled = Integration(spec, override)
+        except Exception as e:
+            self.errors += 1
+            print(f"Integration spec {self.path.name} not loaded: {e}")
+            if initial:
+                compiled = Integration(self.fallback, override)
+            else:
+                self._mtime = mtime  # don't retry until the file changes again
+                return self._current
+        self._mtime = mtime
+        if not initial:
+            self.reloads += 1
+            print(f"Integration spec {self.path.name} reloaded")
+        return compiled
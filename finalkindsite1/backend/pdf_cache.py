@@ -0,0 +1,117 @@
+import os
+import json
+import time
+import sqlite3
+import tempfile
+import threading
+from collections import OrderedDict
+
+# ================== PDF CONVERSION CACHE ==================
+# The same syllabus or slide deck gets uploaded by a whole course. Upstream replies
+# are keyed on (sha256 of the uploaded bytes, the upstream form fields such as
+# accessibility_preset), hashed as the upload is spooled, so a repeat upload is
+# answered from here instead of the multi-minute upstream run. The raw reply is
+# stored, so a changed response mapping applies to cached results too. Memory
+# LRU in front of a SQLite file with TTL and total-size eviction;
+# PDF_CACHE_DB="" keeps it in memory only.
+PDF_CACHE_DB = os.getenv("PDF_CACHE_DB", os.path.join(tempfile.gettempdir(), "kindsite-pdf-cache.sqlite3"))
+PDF_CACHE_MAX_BYTES = int(os.getenv("PDF_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+PDF_CACHE_MAX_ENTRIES = int(os.getenv("PDF_CACHE_MAX_ENTRIES", "512"))
+PDF_CACHE_TTL = int(os.getenv("PDF_CACHE_TTL_SEC", str(7 * 24 * 3600)))
+
+def cache_key(sha256: str, fields: dict) -> str:
+    """fields are the upstream form fields (accessibility_preset and any the spec adds)."""
+    return f"{sha256}:{json.dumps(fields, sort_keys=True, separators=(',', ':'))}"
+
+class PdfResultCache:
+    def __init__(self, db_path: str = PDF_CACHE_DB, max_bytes: int = PDF_CACHE_MAX_BYTES,
+                 max_entries: int = PDF_CACHE_MAX_ENTRIES, ttl: int = PDF_CACHE_TTL):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._mem = OrderedDict()  # key -> (created, result)
+        self._lock = threading.Lock()
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                " key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL,"
+                " created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS results_accessed_idx ON results(accessed)")
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str):
+        now = time.time()
+        with self._lock:
+            entry = self._mem.get(key)
+            if entry and now - entry[0] <= self.ttl:
+                self._mem.move_to_end(key)
+                self.hits += 1
+                return dict(entry[1])
+            if entry:
+                del self._mem[key]
+            if self._db is not None:
+                row = self._db.execute("SELECT value, created FROM results WHERE key = ?", (key,)).fetchone()
+                if row and now - row[1] <= self.ttl:
+                    self._db.execute("UPDATE results SET accessed = ? WHERE key = ?", (now, key))
+                    result = json.loads(row[0])
+                    self._put_mem(key, result, row[1])
+                    self.hits += 1
+                    return dict(result)
+            self.misses += 1
+            return None
+
+    def set(self, key: str, result: dict) -> None:
+        now = time.time()
+        value = json.dumps(result, separators=(",", ":"))
+        with self._lock:
+            self._put_mem(key, result, now)
+            if self._db is None:
+                return
+            self._db.execute(
+                "INSERT OR REPLACE INTO results (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, value, len(value.encode("utf-8")), now, now),
+            )
+            self._evict(now)
+
+    def _put_mem(self, key, result, created) -> None:
+        self._mem[key] = (created, dict(result))
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.max_entries:
+            self._mem.popitem(last=False)
+
+    def _evict(self, now: float) -> None:
+        # caller holds self._lock
+        self._db.execute("DELETE FROM results WHERE created < ?", (now - self.ttl,))
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self._db.execute("SELECT key, size FROM results ORDER BY accessed").fetchall():
+            self._db.execute("DELETE FROM results WHERE key = ?", (key,))
+            self._mem.pop(key, None)
+            self.evictions += 1
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            stats = {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / total) if total else 0.0,
+                "entries": len(self._mem),
+                "evictions": self.evictions,
+                "disk": self._db is not None,
+            }
+            if self._db is not None:
+                stats["disk_bytes"] = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+            return stats
+
+pdf_cache = PdfResultCache()
@@ -0,0 +1,153 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# ================== PDF CONVERSION JOBS ==================
+# A conversion on the upstream worker can take minutes. In job mode the request
+# only spools the upload and returns a job id; a bounded local pool does the
+# upstream call. Job records live in memory, or in SQLite (PDF_JOBS_DB) so any
+# worker process can answer status/event requests. No external broker needed.
+PDF_JOB_WORKERS = int(os.getenv("PDF_JOB_WORKERS", "2"))
+PDF_JOB_MAX_PENDING = int(os.getenv("PDF_JOB_MAX_PENDING", "50"))
+PDF_JOB_TTL = int(os.getenv("PDF_JOB_TTL_SEC", "3600"))  # finished jobs are kept this long
+PDF_JOBS_DB = os.getenv("PDF_JOBS_DB", "")  # empty = in-process only
+
+FINISHED = ("done", "error")
+
+class QueueFull(Exception):
+    pass
+
+class _MemoryStore:
+    def __init__(self):
+        self._jobs = {}
+
+    def load(self, job_id):
+        job = self._jobs.get(job_id)
+        return dict(job) if job else None
+
+    def save(self, job):
+        self._jobs[job["id"]] = dict(job)
+
+    def purge(self, before):
+        for job_id in [j["id"] for j in self._jobs.values() if j["status"] in FINISHED and j["updated_at"] < before]:
+            del self._jobs[job_id]
+
+class _SQLiteStore:
+    def __init__(self, path):
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS pdf_jobs (id TEXT PRIMARY KEY, status TEXT, body TEXT, updated_at REAL)"
+        )
+
+    def load(self, job_id):
+        row = self._db.execute("SELECT body FROM pdf_jobs WHERE id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save(self, job):
+        self._db.execute(
+            "INSERT OR REPLACE INTO pdf_jobs (id, status, body, updated_at) VALUES (?, ?, ?, ?)",
+            (job["id"], job["status"], json.dumps(job, default=str), job["updated_at"]),
+        )
+
+    def purge(self, before):
+        self._db.execute(
+            "DELETE FROM pdf_jobs WHERE status IN ('done', 'error') AND updated_at < ?", (before,)
+        )
+
+class JobQueue:
+    def __init__(self, workers: int = PDF_JOB_WORKERS, max_pending: int = PDF_JOB_MAX_PENDING,
+                 db_path: str = PDF_JOBS_DB, ttl: int = PDF_JOB_TTL):
+        self.max_pending = max_pending
+        self.ttl = ttl
+        self._store = _SQLiteStore(db_path) if db_path else _MemoryStore()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="pdf-job")
+        self._cond = threading.Condition()
+        self._pending = 0
+        self.stats = {"submitted": 0, "done": 0, "failed": 0, "rejected": 0}
+
+    def submit(self, fn, *args, cleanup=None) -> dict:
+        """
+        Queue fn(progress, *args); its return value becomes the job result.
+        progress(stage, **info) updates the job. cleanup() runs after fn either way.
+        Raises QueueFull when max_pending jobs are already queued or running.
+        """
+        now = time.time()
+        job = {"id": uuid.uuid4().hex, "status": "queued", "stage": "queued", "info": {},
+               "result": None, "error": None, "created_at": now, "updated_at": now, "version": 0}
+        with self._cond:
+            if self._pending >= self.max_pending:
+                self.stats["rejected"] += 1
+                raise QueueFull(f"{self._pending} conversions already pending")
+            self._pending += 1
+            self.stats["submitted"] += 1
+            self._store.purge(now - self.ttl)
+            self._store.save(job)
+        self._pool.submit(self._run, job["id"], fn, args, cleanup)
+        return dict(job)
+
+    def get(self, job_id: str):
+        with self._cond:
+            return self._store.load(job_id)
+
+    def wait(self, job_id: str, version: int, timeout: float):
+        """Job once its version moves past `version`, or as-is after timeout (for SSE polling)."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                job = self._store.load(job_id)
+                if job is None or job["version"] != version:
+                    return job
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return job
+                # Local updates notify; updates from other processes show up on the next poll
+                self._cond.wait(min(remaining, 1.0))
+
+    def pending(self) -> int:
+        with self._cond:
+            return self._pending
+
+    def _update(self, job_id, **fields) -> None:
+        with self._cond:
+            job = self._store.load(job_id)
+            if job is None:
+                return
+            job.update(fields, updated_at=time.time(), version=job["version"] + 1)
+            self._store.save(job)
+            self._cond.notify_all()
+
+    def _run(self, job_id, fn, args, cleanup) -> None:
+        self._update(job_id, status="running", stage="starting")
+        try:
+            result = fn(lambda stage, **info: self._update(job_id, stage=stage, info=info), *args)
+            self._update(job_id, status="done", stage="done", result=result)
+            key = "done"
+        except Exception as e:
+            self._update(job_id, status="error", stage="error", error=str(e))
+            key = "failed"
+        finally:
+            if cleanup:
+                try:
+                    cleanup()
+                except Exception as e:
+                    print(f"PDF job cleanup failed: {e}")
+            with self._cond:
+                self._pending -= 1
+        with self._cond:
+            self.stats[key] += 1
+
+def public_view(job: dict) -> dict:
+    """The job as returned to clients."""
+    view = {k: job[k] for k in ("id", "status", "stage", "info", "created_at", "updated_at")}
+    if job["status"] == "done":
+        view["result"] = job["result"]
+    if job["status"] == "error":
+        view["error"] = job["error"]
+    return view
+
+pdf_jobs = JobQueue()
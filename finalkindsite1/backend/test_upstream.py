@@ -0,0 +1,179 @@
+import random
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+import upstream
+from upstream import UpstreamBusy, UpstreamClient
+
+FLAKY_RATE = 0.3
+STUB_DELAY = 0.01
+
+class _Stub(BaseHTTPRequestHandler):
+    """
+    /flaky 502s FLAKY_RATE of the time; /ok answers 200; /read-then-502 and
+    /read-then-drop consume the whole body before failing; /slow waits 0.3s.
+    """
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = self._read_body()
+        server = self.server
+        with server.lock:
+            server.hits[self.path] = server.hits.get(self.path, 0) + 1
+            server.bodies.append(len(body))
+            fail = server.rng.random() < FLAKY_RATE
+        if self.path == "/read-then-drop":
+            self.close_connection = True
+            self.connection.close()
+            return
+        if self.path == "/slow":
+            with server.lock:
+                server.active += 1
+                server.peak = max(server.peak, server.active)
+            time.sleep(0.3)
+            with server.lock:
+                server.active -= 1
+        time.sleep(STUB_DELAY)
+        status = 502 if self.path == "/read-then-502" or (self.path == "/flaky" and fail) else 200
+        payload = b'{"ok": true}' if status == 200 else b'{"error": "bad gateway"}'
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _read_body(self) -> bytes:
+        if self.headers.get("Transfer-Encoding") == "chunked":
+            parts = []
+            while True:
+                size = int(self.rfile.readline().strip(), 16)
+                if size == 0:
+                    self.rfile.readline()
+                    return b"".join(parts)
+                parts.append(self.rfile.read(size))
+                self.rfile.readline()
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def stub():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Stub)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.hits = {}
+    server.bodies = []
+    server.active = server.peak = 0
+    server.rng = random.Random(1234)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server, f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(upstream, "UPSTREAM_BACKOFF_BASE", 0.01)
+    monkeypatch.setattr(upstream, "UPSTREAM_BACKOFF_MAX", 0.05)
+
+def _run_flaky(base: str, retries: int, calls: int = 300):
+    client = UpstreamClient(retries=retries)
+
+    def one(_):
+        started = time.monotonic()
+        r = client.post(f"{base}/flaky", data=b"x" * 64, idempotent=True, timeout=5)
+        return r.status_code == 200, time.monotonic() - started
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(one, range(calls)))
+    success = sum(ok for ok, _ in results) / calls
+    latencies = sorted(t for _, t in results)
+    return client, success, latencies
+
+def test_retries_raise_success_rate_on_a_flaky_upstream(stub):
+    _, base = stub
+    _, plain, plain_lat = _run_flaky(base, retries=0)
+    client, retried, retried_lat = _run_flaky(base, retries=2)
+    stats = next(iter(client.stats().values()))
+
+    # 30% 502s: ~70% without retries, ~97% with two (1 - 0.3^3)
+    assert plain < 0.85
+    assert retried >= 0.93
+    assert stats["retries"] > 0 and stats["in_flight"] == 0
+    # Retries add at most a couple of short backoffs to the median call
+    added = statistics.median(retried_lat) - statistics.median(plain_lat)
+    assert added < 0.1, f"median latency added by retries: {added:.3f}s"
+    assert retried_lat[int(len(retried_lat) * 0.95)] < 0.5
+
+def test_non_idempotent_post_is_not_resent_after_a_502(stub):
+    server, base = stub
+    client = UpstreamClient(retries=2)
+    r = client.post(f"{base}/read-then-502", data=b"generate", timeout=5)
+    assert r.status_code == 502
+    assert server.hits["/read-then-502"] == 1
+
+@pytest.mark.parametrize("body", [lambda: b"part-1part-2", lambda: iter([b"part-1", b"part-2"])], ids=["bytes", "stream"])
+def test_non_idempotent_post_is_not_resent_after_the_body_went_out(stub, body):
+    server, base = stub
+    client = UpstreamClient(retries=2)
+    with pytest.raises(requests.ConnectionError):
+        client.post(f"{base}/read-then-drop", data=body(), timeout=5)
+    assert server.hits["/read-then-drop"] == 1
+    assert server.bodies == [12]
+    assert next(iter(client.stats().values()))["in_flight"] == 0
+
+def test_idempotent_replayable_body_is_resent(stub):
+    server, base = stub
+    client = UpstreamClient(retries=2)
+    r = client.post(f"{base}/read-then-502", body_factory=lambda: iter([b"abc", b"def"]), idempotent=True, timeout=5)
+    assert r.status_code == 502
+    assert server.hits["/read-then-502"] == 3
+    assert server.bodies == [6, 6, 6]
+
+def test_post_is_retried_when_it_never_reached_the_upstream():
+    # Nothing listens on the port: the connection fails before any byte is sent
+    client = UpstreamClient(retries=2)
+    with pytest.raises(requests.ConnectionError):
+        client.post("http://127.0.0.1:9/generate", data=b"generate", timeout=5)
+    stats = client.stats()["http://127.0.0.1:9"]
+    assert stats["requests"] == 3 and stats["retries"] == 2 and stats["in_flight"] == 0
+
+def test_slots_are_released_and_busy_hosts_fail_fast(stub, monkeypatch):
+    _, base = stub
+    monkeypatch.setattr(upstream, "UPSTREAM_QUEUE_TIMEOUT", 0.2)
+    client = UpstreamClient(max_concurrency=1, retries=0)
+
+    # A streamed response holds the host's only slot until it is closed
+    held = client.post(f"{base}/ok", data=b"x", stream=True, timeout=5)
+    started = time.monotonic()
+    with pytest.raises(UpstreamBusy):
+        client.post(f"{base}/ok", data=b"x", timeout=5)
+    assert time.monotonic() - started < 1.0
+    held.close()
+    held.close()  # a second close must not release the slot twice
+
+    # Buffered calls, failed calls and 5xx responses all give their slot back
+    assert client.post(f"{base}/ok", data=b"x", timeout=5).status_code == 200
+    assert client.post(f"{base}/read-then-502", data=b"x", timeout=5).status_code == 502
+    with pytest.raises(requests.ConnectionError):
+        client.post(f"{base}/read-then-drop", data=b"x", timeout=5)
+    assert client.post(f"{base}/ok", data=b"x", timeout=5).status_code == 200
+
+    stats = next(iter(client.stats().values()))
+    assert stats["busy"] == 1 and stats["in_flight"] == 0
+
+def test_concurrency_cap_holds_under_load(stub, monkeypatch):
+    server, base = stub
+    monkeypatch.setattr(upstream, "UPSTREAM_QUEUE_TIMEOUT", 5)
+    client = UpstreamClient(max_concurrency=2, retries=0)
+    with ThreadPoolExecutor(max_workers=6) as pool:
+        codes = list(pool.map(lambda _: client.post(f"{base}/slow", data=b"x", timeout=5).status_code, range(6)))
+    assert codes == [200] * 6
+    assert server.peak == 2
@@ -0,0 +1,187 @@
+import os
+import uuid
+import tempfile
+
+from werkzeug.datastructures import Headers
+from werkzeug.sansio.multipart import (
+    MultipartDecoder, MultipartEncoder, Data, Epilogue, Field, File, NeedData,
+)
+
+# ================== STREAMING PDF UPLOADS ==================
+# request.files makes Werkzeug spool the whole upload, and requests' files= then
+# rebuilds the multipart body in memory. Instead the incoming body is decoded in
+# UPLOAD_CHUNK_BYTES pieces and re-encoded on the fly into a chunked upstream
+# request, so memory stays at a few chunks whatever the PDF size.
+PDF_MAX_UPLOAD_BYTES = int(os.getenv("PDF_MAX_UPLOAD_BYTES", str(250 * 1024 * 1024)))
+UPLOAD_CHUNK_BYTES = int(os.getenv("UPLOAD_CHUNK_BYTES", str(256 * 1024)))
+FILE_FIELDS = ("file", "file_input")
+MAX_FIELD_BYTES = 64 * 1024  # text fields are buffered, so keep them small
+
+class UploadTooLarge(Exception):
+    pass
+
+class BadUpload(ValueError):
+    pass
+
+class StreamedUpload:
+    """
+    One file part read straight off a multipart request body.
+    open() consumes up to the file's headers, chunks() yields its bytes; text fields
+    are collected in .form (those after the file only once chunks() is exhausted).
+    """
+
+    def __init__(self, stream, content_type: str, max_bytes: int = PDF_MAX_UPLOAD_BYTES,
+                 chunk_size: int = UPLOAD_CHUNK_BYTES):
+        boundary = _boundary(content_type)
+        if not boundary:
+            raise BadUpload("Expected multipart/form-data")
+        self._stream = stream
+        self._decoder = MultipartDecoder(boundary.encode("latin-1"))
+        self._max_bytes = max_bytes
+        self._chunk_size = chunk_size
+        self._field = None  # (name, [bytes]) for the text field being read
+        self._eof = False
+        self.form = {}
+        self.filename = None
+        self.mimetype = None
+        self.received = 0  # raw request bytes
+        self.size = 0      # file bytes
+
+    def open(self) -> bool:
+        """Advance to the file part; False if the body has none."""
+        for event in self._events():
+            if isinstance(event, File) and event.name in FILE_FIELDS:
+                self.filename = event.filename or "upload.pdf"
+                self.mimetype = event.headers.get("Content-Type")
+                return True
+            self._collect(event)
+        return False
+
+    def chunks(self):
+        for event in self._events():
+            if isinstance(event, Data):
+                self.size += len(event.data)
+                if event.data:
+                    yield event.data
+                if not event.more_data:
+                    break
+        # Drain the rest so fields sent after the file are available
+        for event in self._events():
+            self._collect(event)
+
+    def _events(self):
+        while True:
+            try:
+                event = self._decoder.next_event()
+            except ValueError as e:
+                raise BadUpload(f"Malformed multipart body: {e}")
+            if isinstance(event, NeedData):
+                if self._eof:
+                    raise BadUpload("Truncated multipart body")
+                self._feed()
+                continue
+            if isinstance(event, Epilogue):
+                return
+            yield event
+
+    def _feed(self) -> None:
+        chunk = self._stream.read(self._chunk_size)
+        if not chunk:
+            self._eof = True
+            self._decoder.receive_data(None)
+            return
+        self.received += len(chunk)
+        if self.received > self._max_bytes:
+            raise UploadTooLarge(f"Upload exceeds {self._max_bytes} bytes")
+        self._decoder.receive_data(chunk)
+
+    def _collect(self, event) -> None:
+        if isinstance(event, Field):
+            self._field = (event.name, [])
+        elif isinstance(event, File):
+            self._field = None  # a second file part; ignored
+        elif isinstance(event, Data) and self._field is not None:
+            self._field[1].append(event.data)
+            if sum(len(part) for part in self._field[1]) > MAX_FIELD_BYTES:
+                raise BadUpload(f"Form field {self._field[0]!r} is too large")
+            if not event.more_data:
+                name, parts = self._field
+                self.form.setdefault(name, b"".join(parts).decode("utf-8", "replace"))
+                self._field = None
+
+def iter_file(path: str, chunk_size: int = UPLOAD_CHUNK_BYTES):
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+class ReplayableChunks:
+    """
+    Makes a one-shot chunk iterator (the client's request body) re-iterable by
+    teeing it to an unnamed temp file, so a failed upstream attempt can be retried
+    without holding the upload in memory. Call it to get a fresh iterator.
+    """
+
+    def __init__(self, chunks, chunk_size: int = UPLOAD_CHUNK_BYTES):
+        self._source = iter(chunks)
+        self._chunk_size = chunk_size
+        self._spool = tempfile.TemporaryFile(prefix="kindsite-replay-")
+        self._spooled = 0
+        self._exhausted = False
+
+    def __call__(self):
+        offset = 0
+        while offset < self._spooled:
+            self._spool.seek(offset)
+            chunk = self._spool.read(min(self._chunk_size, self._spooled - offset))
+            offset += len(chunk)
+            yield chunk
+        while not self._exhausted:
+            chunk = next(self._source, None)
+            if chunk is None:
+                self._exhausted = True
+                return
+            self._spool.seek(self._spooled)
+            self._spool.write(chunk)
+            self._spooled += len(chunk)
+            yield chunk
+
+    def close(self) -> None:
+        self._spool.close()
+
+def new_boundary() -> str:
+    return f"kindsite-{uuid.uuid4().hex}"
+
+def encode_multipart(file_field: str, filename: str, mimetype: str, chunks, fields, boundary: str = None):
+    """
+    Returns (content_type, body generator). The file part streams from `chunks`;
+    `fields` (a dict, or a callable returning one) is resolved after the file so
+    it may depend on form fields that followed the file in the incoming body.
+    """
+    boundary = boundary or new_boundary()
+
+    def body():
+        encoder = MultipartEncoder(boundary.encode("latin-1"))
+        headers = Headers({"Content-Type": mimetype or "application/pdf"})
+        yield encoder.send_event(File(name=file_field, filename=filename, headers=headers))
+        for chunk in chunks:
+            yield encoder.send_event(Data(data=chunk, more_data=True))
+        yield encoder.send_event(Data(data=b"", more_data=False))
+        for name, value in (fields() if callable(fields) else fields).items():
+            yield encoder.send_event(Field(name=name, headers=Headers()))
+            yield encoder.send_event(Data(data=str(value).encode("utf-8"), more_data=False))
+        yield encoder.send_event(Epilogue(data=b""))
+
+    return f"multipart/form-data; boundary={boundary}", body()
+
+def _boundary(content_type: str):
+    mime, _, params = (content_type or "").partition(";")
+    if mime.strip().lower() != "multipart/form-data":
+        return None
+    for param in params.split(";"):
+        key, _, value = param.strip().partition("=")
+        if key.lower() == "boundary":
+            return value.strip('"') or None
+    return None
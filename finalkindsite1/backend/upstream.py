@@ -0,0 +1,190 @@
+import os
+import time
+import random
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+# ================== UPSTREAM HTTP CLIENT ==================
+# Shared by the PDF and chat proxies. One keep-alive Session per upstream host
+# (no connection setup per forward), a per-host concurrency cap so a slow
+# upstream can't absorb every request worker, and retries with full-jitter
+# backoff. A request is only re-sent if that's safe: the connection failed before
+# any of the body went out, or the call is idempotent and its body can be rebuilt.
+UPSTREAM_POOL_SIZE = int(os.getenv("UPSTREAM_POOL_SIZE", "20"))
+UPSTREAM_MAX_CONCURRENCY = int(os.getenv("UPSTREAM_MAX_CONCURRENCY", "16"))  # per host
+UPSTREAM_QUEUE_TIMEOUT = float(os.getenv("UPSTREAM_QUEUE_TIMEOUT_SEC", "30"))
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT_SEC", "5"))
+UPSTREAM_RETRIES = int(os.getenv("UPSTREAM_RETRIES", "2"))
+UPSTREAM_BACKOFF_BASE = float(os.getenv("UPSTREAM_BACKOFF_BASE_SEC", "0.25"))
+UPSTREAM_BACKOFF_MAX = float(os.getenv("UPSTREAM_BACKOFF_MAX_SEC", "4"))
+
+RETRY_STATUSES = (502, 503, 504)
+
+class UpstreamBusy(Exception):
+    """Every slot for the upstream host stayed taken for UPSTREAM_QUEUE_TIMEOUT."""
+
+class _TrackedBody:
+    """Wraps a streamed body to tell whether any of it has been sent."""
+
+    def __init__(self, body):
+        self._body = body
+        self.started = False
+
+    def __iter__(self):
+        for chunk in self._body:
+            self.started = True
+            yield chunk
+
+class _Host:
+    def __init__(self, pool_size: int, max_concurrency: int):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.slots = threading.BoundedSemaphore(max_concurrency)
+        self.stats = {"requests": 0, "retries": 0, "failures": 0, "busy": 0, "in_flight": 0, "retry_delay_sec": 0.0}
+
+class UpstreamClient:
+    def __init__(self, pool_size: int = UPSTREAM_POOL_SIZE, max_concurrency: int = UPSTREAM_MAX_CONCURRENCY,
+                 retries: int = UPSTREAM_RETRIES):
+        self.pool_size = pool_size
+        self.max_concurrency = max_concurrency
+        self.retries = retries
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def request(self, method: str, url, *, data=None, body_factory=None, idempotent=None,
+                timeout: float = 120, stream: bool = False, observer=None, **kwargs) -> requests.Response:
+        """
+        requests-style call through the host's pooled session.
+        url may be a callable returning the URL for each attempt (see balancer.py); observer,
+        if given, is called as observer(url, ok, elapsed) after every attempt (ok=None when
+        the attempt ended on our side). body_factory() builds a fresh body per attempt (use it
+        for generators that can be replayed); idempotent defaults to True except for POST/PATCH.
+        With stream=True the host slot is held until the response is closed.
+        """
+        if idempotent is None:
+            idempotent = method.upper() not in ("POST", "PATCH")
+        timeout = (UPSTREAM_CONNECT_TIMEOUT, timeout)
+
+        for attempt in range(self.retries + 1):
+            target = url() if callable(url) else url
+            host = self._host(target)
+            body = body_factory() if body_factory else data
+            tracked = _TrackedBody(body) if _is_stream(body) else None
+            replayable = tracked is None or body_factory is not None
+            last = attempt == self.retries
+
+            release = self._acquire(host, target, observer)
+            started = time.monotonic()
+            outcome = None
+            try:
+                self._count(host, "requests")
+                resp = host.session.request(method, target, data=tracked or body, timeout=timeout, stream=stream, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                release()
+                outcome = False
+                if last or not (_never_sent(e, tracked) or (idempotent and replayable)):
+                    self._count(host, "failures")
+                    raise
+            except BaseException:
+                release()
+                raise
+            else:
+                outcome = resp.status_code < 500
+                retry = resp.status_code in RETRY_STATUSES and not last and idempotent and replayable
+                if not retry:
+                    if not outcome:
+                        self._count(host, "failures")
+                    if stream:
+                        return self._hold(resp, release)
+                    release()
+                    return resp
+                delay = _retry_after(resp)
+                resp.close()
+                release()
+                if delay is not None:
+                    self._sleep(host, min(delay, UPSTREAM_BACKOFF_MAX))
+                    continue
+            finally:
+                if observer:
+                    observer(target, outcome, time.monotonic() - started)
+            self._sleep(host, random.uniform(0, min(UPSTREAM_BACKOFF_MAX, UPSTREAM_BACKOFF_BASE * 2 ** attempt)))
+
+    def post(self, url, **kwargs) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {netloc: dict(host.stats) for netloc, host in self._hosts.items()}
+
+    def _acquire(self, host, target, observer):
+        if not host.slots.acquire(timeout=UPSTREAM_QUEUE_TIMEOUT):
+            self._count(host, "busy")
+            if observer:
+                observer(target, None, 0.0)
+            raise UpstreamBusy(f"{urlsplit(target).netloc} is at its concurrency limit")
+        self._count(host, "in_flight")
+        released = []
+
+        def release():
+            if not released:
+                released.append(True)
+                self._count(host, "in_flight", -1)
+                host.slots.release()
+        return release
+
+    def _hold(self, resp, release):
+        close = resp.close
+
+        def close_and_release():
+            try:
+                close()
+            finally:
+                release()
+
+        resp.close = close_and_release
+        return resp
+
+    def _sleep(self, host, delay: float) -> None:
+        with self._lock:
+            host.stats["retries"] += 1
+            host.stats["retry_delay_sec"] += delay
+        time.sleep(delay)
+
+    def _host(self, url: str) -> _Host:
+        parts = urlsplit(url)
+        key = f"{parts.scheme}://{parts.netloc}"
+        with self._lock:
+            host = self._hosts.get(key)
+            if host is None:
+                host = self._hosts[key] = _Host(self.pool_size, self.max_concurrency)
+            return host
+
+    def _count(self, host, key: str, n: int = 1) -> None:
+        with self._lock:
+            host.stats[key] += n
+
+def _is_stream(body) -> bool:
+    return body is not None and not isinstance(body, (bytes, str, dict, list, tuple)) and hasattr(body, "__iter__")
+
+def _never_sent(exc, tracked) -> bool:
+    """True if the failed attempt can't have delivered the request (safe to re-send)."""
+    if tracked is not None:
+        return not tracked.started
+    if isinstance(exc, requests.ConnectTimeout):
+        return True
+    reason = getattr(exc.args[0], "reason", None) if exc.args else None
+    return isinstance(reason, NewConnectionError)
+
+def _retry_after(resp):
+    try:
+        return float(resp.headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+upstream = UpstreamClient()
@@ -1,85 +1,202 @@
 import os
-from flask import Flask, request, jsonify
+import json
+from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
 from dotenv import load_dotenv
 from pydantic import BaseModel, ValidationError, field_validator
 from typing import List, Optional
 
-from utils import clamp_text, clamp_images, sanitize_html
-from prompts import build_multimodal_prompt
-from gemini_client import call_gemini_multimodal, GeminiError
+from utils import clamp_images, normalize_text, sanitize_html, IncrementalSanitizer, MAX_TEXT
+from prompts import build_multimodal_prompt, PROFILES
+from gemini_client import call_gemini_multimodal, stream_gemini_multimodal, GeminiError, MODEL, warm_up, stats as gemini_stats
+from cache import ResponseCache, make_key
+from singleflight import SingleFlight
+from longdoc import adapt_long_document
 
 load_dotenv()
 
 app = Flask(__name__)
 CORS(app, resources={r"/*": {"origins": "*"}})
 
+response_cache = ResponseCache()
+flight = SingleFlight()
+
+FALLBACK_HTML = (
+    "<div><h2>Summary</h2>"
+    "<p>We adapted available text, but the AI backend had an issue.</p></div>"
+)
+
 class AdaptPageIn(BaseModel):
     profile: str = "ADHD"
     page_text: str
     image_urls: List[str] = []
     origin: Optional[str] = None
     dom_hints: Optional[list] = None  # reserved for future use
+    long_document: Optional[bool] = None  # None = auto (text longer than MAX_TEXT_CHARS)
 
     @field_validator("profile")
     @classmethod
     def check_profile(cls, v: str) -> str:
         v = (v or "ADHD").upper()
-        if v not in {"ADHD", "DYSLEXIA"}:
+        if v not in PROFILES:
             v = "ADHD"
         return v
 
 class AdaptPageOut(BaseModel):
     final_html: str
 
-@app.post("/adapt-page")
-def adapt_page():
-    try:
-        data = AdaptPageIn(**(request.get_json(force=True) or {}))
-    except ValidationError as e:
-        return jsonify({"error": "invalid_input", "detail": e.errors()}), 400
-
-    # Trim for latency
-    text = clamp_text(data.page_text or "")
+def prepare_request(data: AdaptPageIn):
+    """
+    Shared by the Flask and ASGI paths: returns (cache_key, model payload).
+    Payload is None for long pages, which go through run_adaptation's map-reduce path.
+    """
     images = clamp_images(data.image_urls)
+    full_text = normalize_text(data.page_text)
+    long_document = data.long_document
+    if long_document is None:
+        long_document = len(full_text) > MAX_TEXT
+    if long_document:
+        return make_key(data.profile, "long", full_text, images, data.origin or "", MODEL), None
 
-    # Build prompt and call model
+    # Same profile + same page -> reuse the already-sanitized fragment
+    cache_key = make_key(data.profile, full_text, images, data.origin or "", MODEL)
+
+    # Trimmed to the model's input-token budget inside the prompt builder
     payload = build_multimodal_prompt(
         origin=data.origin or "",
         profile=data.profile,
-        page_text=text,
+        page_text=data.page_text or "",
         image_urls=images
     )
+    return cache_key, payload
+
+def run_adaptation(data: AdaptPageIn, cache_key: str, payload: Optional[dict]) -> str:
+    """
+    Model call + sanitize for one request, caching complete results. Raises GeminiError.
+    """
+    if payload is None:
+        safe, complete = adapt_long_document(
+            data.origin or "", data.profile, data.page_text,
+            clamp_images(data.image_urls), response_cache
+        )
+        if not complete:
+            return safe  # sections that fell back are retried on the next request
+    else:
+        safe = sanitize_html(call_gemini_multimodal(payload))
+    response_cache.set(cache_key, safe)
+    return safe
 
+@app.post("/adapt-page")
+def adapt_page():
     try:
-        raw_html = call_gemini_multimodal(payload)
+        data = AdaptPageIn(**(request.get_json(force=True) or {}))
+    except ValidationError as e:
+        return jsonify({"error": "invalid_input", "detail": e.errors()}), 400
+
+    cache_key, payload = prepare_request(data)
+    cached = response_cache.get(cache_key)
+    if cached is not None:
+        return jsonify(AdaptPageOut(final_html=cached).model_dump())
+
+    # Identical concurrent requests share one model call
+    try:
+        safe_html = flight.do(cache_key, lambda: run_adaptation(data, cache_key, payload))
     except GeminiError:
-        raw_html = (
-            "<div><h2>Summary</h2>"
-            "<p>We adapted available text, but the AI backend had an issue.</p></div>"
-        )
+        return jsonify(AdaptPageOut(final_html=sanitize_html(FALLBACK_HTML)).model_dump())
 
-    safe_html = sanitize_html(raw_html)
     return jsonify(AdaptPageOut(final_html=safe_html).model_dump())
 
+def _sse(event: dict) -> str:
+    return f"data: {json.dumps(event)}\n\n"
+
+@app.post("/adapt-page/stream")
+def adapt_page_stream():
+    """
+    Opt-in SSE variant of /adapt-page. Emits {"type": "chunk", "html"} events as
+    top-level elements complete, then {"type": "done"}. If the concatenated chunks
+    differ from a single sanitize_html pass, "done" carries "final_html" to replace them.
+    """
+    try:
+        data = AdaptPageIn(**(request.get_json(force=True) or {}))
+    except ValidationError as e:
+        return jsonify({"error": "invalid_input", "detail": e.errors()}), 400
+
+    cache_key, payload = prepare_request(data)
+
+    def generate():
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            yield _sse({"type": "chunk", "html": cached})
+            yield _sse({"type": "done"})
+            return
+
+        if payload is None:
+            # Long pages are merged from parallel sections; send the document once
+            try:
+                safe_html = run_adaptation(data, cache_key, payload)
+            except GeminiError:
+                safe_html = sanitize_html(FALLBACK_HTML)
+            yield _sse({"type": "chunk", "html": safe_html})
+            yield _sse({"type": "done"})
+            return
+
+        sanitizer = IncrementalSanitizer()
+        raw, sent = [], []
+        try:
+            for delta in stream_gemini_multimodal(payload):
+                raw.append(delta)
+                html = sanitizer.feed(delta)
+                if html:
+                    sent.append(html)
+                    yield _sse({"type": "chunk", "html": html})
+        except GeminiError:
+            yield _sse({"type": "done", "final_html": sanitize_html(FALLBACK_HTML)})
+            return
+
+        html = sanitizer.close()
+        if html:
+            sent.append(html)
+            yield _sse({"type": "chunk", "html": html})
+
+        safe_html = sanitize_html("".join(raw))
+        response_cache.set(cache_key, safe_html)
+        if "".join(sent) != safe_html:
+            yield _sse({"type": "done", "final_html": safe_html})
+        else:
+            yield _sse({"type": "done"})
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+CU_STUB_ACTIONS = [
+    {"type": "CLICK", "textContains": "Read more"},
+    {"type": "WAIT", "ms": 400},
+    {"type": "CLICK", "textContains": "Accept all"}
+]
+
 @app.post("/cu-expand")
 def cu_expand():
     """
     Person C (Computer Use) will replace this stub to call Gemini 2.5 CU
     and return a small list of safe actions for the front-end to execute.
     """
-    return jsonify([
-        {"type": "CLICK", "textContains": "Read more"},
-        {"type": "WAIT", "ms": 400},
-        {"type": "CLICK", "textContains": "Accept all"}
-    ])
+    return jsonify(CU_STUB_ACTIONS)
 
 @app.get("/healthz")
 def healthz():
     return jsonify({"ok": True})
 
+@app.get("/metrics")
+def metrics():
+    return jsonify({"cache": response_cache.stats(), "singleflight": flight.stats(), "model": gemini_stats()})
+
 if __name__ == "__main__":
     host = os.getenv("HOST", "0.0.0.0")
     port = int(os.getenv("PORT", "5000"))
     debug = os.getenv("DEBUG", "false").lower() == "true"
+    if os.getenv("GEMINI_WARMUP", "true").lower() == "true":
+        warm_up()
     app.run(host=host, port=port, debug=debug)
@@ -0,0 +1,81 @@
+"""
+asyncio-native serving mode for the adaptation server.
+
+Same routes and pydantic contracts as app.py, but /adapt-page awaits the model
+on the event loop instead of parking a worker thread for up to REQUEST_TIMEOUT_SEC.
+Run with:  uvicorn asgi_app:app --host 0.0.0.0 --port 5000
+"""
+import asyncio
+from contextlib import asynccontextmanager
+from pydantic import ValidationError
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+from app import AdaptPageIn, AdaptPageOut, FALLBACK_HTML, CU_STUB_ACTIONS, prepare_request, run_adaptation, response_cache
+from utils import sanitize_html
+from gemini_client import acall_gemini_multimodal, aclose, GeminiError, stats as gemini_stats
+from singleflight import AsyncSingleFlight
+
+aflight = AsyncSingleFlight()
+
+async def adapt_page(request: Request):
+    try:
+        body = await request.json()
+    except ValueError:
+        body = {}
+    try:
+        data = AdaptPageIn(**(body or {}))
+    except ValidationError as e:
+        return JSONResponse({"error": "invalid_input", "detail": e.errors()}, status_code=400)
+
+    cache_key, payload = prepare_request(data)
+    cached = response_cache.get(cache_key)
+    if cached is not None:
+        return JSONResponse(AdaptPageOut(final_html=cached).model_dump())
+
+    async def adapt():
+        if payload is None:
+            # Long pages fan out over longdoc's bounded thread pool
+            return await asyncio.to_thread(run_adaptation, data, cache_key, payload)
+        raw_html = await acall_gemini_multimodal(payload)
+        # bleach is CPU-bound; keep it off the event loop
+        safe = await asyncio.to_thread(sanitize_html, raw_html)
+        response_cache.set(cache_key, safe)
+        return safe
+
+    # Identical concurrent requests share one model call
+    try:
+        safe_html = await aflight.do(cache_key, adapt)
+    except GeminiError:
+        return JSONResponse(AdaptPageOut(final_html=sanitize_html(FALLBACK_HTML)).model_dump())
+
+    return JSONResponse(AdaptPageOut(final_html=safe_html).model_dump())
+
+async def cu_expand(request: Request):
+    return JSONResponse(CU_STUB_ACTIONS)
+
+async def healthz(request: Request):
+    return JSONResponse({"ok": True})
+
+@asynccontextmanager
+async def lifespan(app):
+    yield
+    await aclose()
+
+async def metrics(request: Request):
+    return JSONResponse({"cache": response_cache.stats(), "singleflight": aflight.stats(), "model": gemini_stats()})
+
+app = Starlette(
+    routes=[
+        Route("/adapt-page", adapt_page, methods=["POST"]),
+        Route("/cu-expand", cu_expand, methods=["POST"]),
+        Route("/healthz", healthz, methods=["GET"]),
+        Route("/metrics", metrics, methods=["GET"]),
+    ],
+    middleware=[Middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])],
+    lifespan=lifespan,
+)
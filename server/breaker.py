@@ -0,0 +1,83 @@
+import time
+import threading
+from collections import deque
+
+class CircuitBreaker:
+    """
+    Opens after `failures` consecutive errors or slow calls (latency > slow_sec) and
+    rejects calls for `cooldown` seconds. After that, one trial call is let through
+    (half-open): success closes the circuit, failure re-opens it.
+    """
+    def __init__(self, failures: int, slow_sec: float, cooldown: float):
+        self.failures = failures
+        self.slow_sec = slow_sec
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._consecutive = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+        self.rejected = 0
+        self.opened = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state(time.monotonic())
+
+    def _state(self, now: float) -> str:
+        if self._opened_at is None:
+            return "closed"
+        return "open" if now - self._opened_at < self.cooldown else "half_open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self._state(time.monotonic())
+            if state == "closed":
+                return True
+            if state == "half_open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record(self, ok: bool, latency: float) -> None:
+        with self._lock:
+            self._trial_in_flight = False
+            if ok and latency <= self.slow_sec:
+                self._consecutive = 0
+                self._opened_at = None
+                return
+            self._consecutive += 1
+            now = time.monotonic()
+            state = self._state(now)
+            if state == "half_open" or (state == "closed" and self._consecutive >= self.failures):
+                self._opened_at = now
+                self.opened += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "state": self._state(time.monotonic()),
+                "consecutive_failures": self._consecutive,
+                "opened": self.opened,
+                "rejected": self.rejected,
+            }
+
+class LatencyWindow:
+    """
+    Rolling window of recent successful call latencies, for the hedging delay.
+    """
+    def __init__(self, size: int = 200):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, latency: float) -> None:
+        with self._lock:
+            self._samples.append(latency)
+
+    def percentile(self, q: float, default: float, min_samples: int = 20) -> float:
+        with self._lock:
+            if len(self._samples) < min_samples:
+                return default
+            ordered = sorted(self._samples)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
@@ -0,0 +1,80 @@
+import os
+import re
+from typing import List, Tuple
+
+from utils import estimate_tokens
+
+PROMPT_MAX_INPUT_TOKENS = int(os.getenv("PROMPT_MAX_INPUT_TOKENS", "12000"))
+IMAGE_TOKENS = int(os.getenv("PROMPT_IMAGE_TOKENS", "258"))
+IMAGE_SHARE = float(os.getenv("PROMPT_IMAGE_SHARE", "0.25"))
+
+_INLINE_WS_RE = re.compile(r"[ \t\r\f\v]+")
+# Short lines that are almost always site chrome rather than page content
+_BOILERPLATE_RE = re.compile(
+    r"^(?:skip to (?:main )?content|menu|home|search|log ?in|sign ?in|sign ?up|log ?out|"
+    r"privacy(?: policy)?|terms(?: of (?:use|service))?|cookie.*|accept(?: all)?(?: cookies)?|"
+    r"back to top|share|print|next|previous|breadcrumb.*|©.*|copyright.*|all rights reserved\.?)$",
+    re.IGNORECASE,
+)
+
+def _blocks(text: str) -> List[str]:
+    # Scraped innerText puts one block element per line; blank lines carry no content
+    return [b for b in (_INLINE_WS_RE.sub(" ", line).strip() for line in (text or "").split("\n")) if b]
+
+def _is_boilerplate(block: str) -> bool:
+    return len(block) <= 80 and _BOILERPLATE_RE.match(block) is not None
+
+def fit_page_text(text: str, max_tokens: int) -> str:
+    """
+    Trim page text to ~max_tokens, dropping the lowest-value content first:
+    whitespace runs, then navigation boilerplate, then repeated blocks,
+    and only then truncating the tail. Single pass per stage, linear in input size.
+    """
+    blocks = _blocks(text)
+    costs = [estimate_tokens(b) + 1 for b in blocks]
+    total = sum(costs)
+
+    if total > max_tokens:
+        kept = [(b, c) for b, c in zip(blocks, costs) if not _is_boilerplate(b)]
+        blocks, costs = [b for b, _ in kept], [c for _, c in kept]
+        total = sum(costs)
+
+    if total > max_tokens:
+        seen = set()
+        kept = []
+        for b, c in zip(blocks, costs):
+            key = b.lower()
+            if key in seen:
+                continue
+            seen.add(key)
+            kept.append((b, c))
+        blocks, costs = [b for b, _ in kept], [c for _, c in kept]
+        total = sum(costs)
+
+    if total > max_tokens:
+        out, used = [], 0
+        for b, c in zip(blocks, costs):
+            if used + c > max_tokens:
+                room = max_tokens - used
+                if room > 8:
+                    out.append(b[:room * 4].rsplit(" ", 1)[0])
+                break
+            out.append(b)
+            used += c
+        blocks = out
+
+    return "\n".join(blocks)
+
+def allocate(system: str, image_urls: List[str], max_tokens: int = PROMPT_MAX_INPUT_TOKENS) -> Tuple[int, List[str]]:
+    """
+    Split the input-token budget: system text first, then image references
+    (capped at IMAGE_SHARE of what remains), page text gets the rest.
+    Returns (page text token budget, images that fit).
+    """
+    remaining = max(max_tokens - estimate_tokens(system), 0)
+    max_images = int(remaining * IMAGE_SHARE) // max(IMAGE_TOKENS, 1)
+    images = list(image_urls[:max_images])
+    remaining -= len(images) * IMAGE_TOKENS
+    # per-image "- url" lines in the user text
+    remaining -= sum(estimate_tokens(u) + 2 for u in images)
+    return max(remaining - 64, 0), images  # 64: [ORIGIN]/[PROFILE] framing
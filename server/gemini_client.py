@@ -1,10 +1,28 @@
 import os
 import json
+import asyncio
+import time
+import threading
 import requests
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from requests.adapters import HTTPAdapter
+
+from breaker import CircuitBreaker, LatencyWindow
 
 API_KEY = os.getenv("GEMINI_API_KEY", "")
 MODEL = os.getenv("GEMINI_MODEL", "gemini-1.5-pro")
 TIMEOUT = int(os.getenv("REQUEST_TIMEOUT_SEC", "30"))
+API_BASE = os.getenv("GEMINI_API_BASE", "https://generativeai.googleapis.com")
+POOL_SIZE = int(os.getenv("GEMINI_POOL_SIZE", "32"))
+USE_HTTP2 = os.getenv("GEMINI_HTTP2", "false").lower() == "true"
+ASYNC_MAX_CONNECTIONS = int(os.getenv("GEMINI_ASYNC_MAX_CONNECTIONS", "512"))
+CONTEXT_CACHE = os.getenv("GEMINI_CONTEXT_CACHE", "false").lower() == "true"
+CONTEXT_CACHE_TTL = int(os.getenv("GEMINI_CONTEXT_CACHE_TTL_SEC", "3600"))
+BREAKER_FAILURES = int(os.getenv("GEMINI_BREAKER_FAILURES", "5"))
+BREAKER_SLOW_SEC = float(os.getenv("GEMINI_BREAKER_SLOW_SEC", "15"))
+BREAKER_COOLDOWN_SEC = float(os.getenv("GEMINI_BREAKER_COOLDOWN_SEC", "30"))
+HEDGE = os.getenv("GEMINI_HEDGE", "false").lower() == "true"
+HEDGE_MIN_DELAY_SEC = float(os.getenv("GEMINI_HEDGE_MIN_DELAY_SEC", "1.0"))
 
 # NOTE:
 # Replace the endpoint/format below with the official Gemini SDK or REST format you're using.
@@ -12,6 +30,147 @@ TIMEOUT = int(os.getenv("REQUEST_TIMEOUT_SEC", "30"))
 
 class GeminiError(Exception): pass
 
+# Fail fast while the backend is degraded instead of waiting out TIMEOUT per request
+breaker = CircuitBreaker(BREAKER_FAILURES, BREAKER_SLOW_SEC, BREAKER_COOLDOWN_SEC)
+latencies = LatencyWindow()
+hedged = {"sent": 0, "won": 0, "skipped": 0}
+_hedge_lock = threading.Lock()
+_hedges_in_flight = 0
+# Only hedges run here; a hedge is skipped rather than queued when every worker is busy
+_hedge_executor = ThreadPoolExecutor(max_workers=POOL_SIZE, thread_name_prefix="gemini-hedge")
+
+def _count_hedge(key: str) -> None:
+    with _hedge_lock:
+        hedged[key] += 1
+
+def _hedge_delay() -> float:
+    # p95 of recent successful calls; before enough samples, a conservative default
+    return max(latencies.percentile(0.95, default=TIMEOUT / 3), HEDGE_MIN_DELAY_SEC)
+
+def _build_session():
+    """
+    One pooled, keep-alive transport per process so each call reuses an open TCP+TLS connection.
+    HTTP/2 is used when GEMINI_HTTP2=true and httpx (with h2) is installed.
+    """
+    headers = {"Content-Type": "application/json", "x-goog-api-key": API_KEY}
+    if USE_HTTP2:
+        try:
+            import httpx
+            return httpx.Client(
+                http2=True,
+                headers=headers,
+                timeout=TIMEOUT,
+                limits=httpx.Limits(max_connections=POOL_SIZE, max_keepalive_connections=POOL_SIZE),
+            )
+        except ImportError:
+            pass
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update(headers)
+    return session
+
+_session = _build_session()
+
+def _endpoint(method: str = "generateContent") -> str:
+    return f"{API_BASE}/v1beta/models/{MODEL}:{method}"
+
+# ---- Cached-context handles (GEMINI_CONTEXT_CACHE) ----
+# system text -> (cachedContents name or None if registration failed, renew_at)
+_context_handles: dict = {}
+_context_registering: set = set()  # system texts with a registration in flight
+_context_lock = threading.Lock()
+_CONTEXT_RENEW_MARGIN = 60  # renew this many seconds before the TTL runs out
+
+def _cached_context(system: str):
+    """
+    Register the static system block once via cachedContents and reuse its handle
+    until shortly before the TTL runs out. Registration failures (e.g. prompt below
+    the model's minimum cacheable size) are remembered for one TTL, so we fall back
+    to sending the prefix inline without retrying on every request.
+    The lock only guards the lookup; the POST runs outside it, by one thread per
+    system text. Others meanwhile keep the old handle (still valid for the margin)
+    or, on first registration, send the prefix inline rather than wait.
+    """
+    now = time.time()
+    with _context_lock:
+        entry = _context_handles.get(system)
+        if entry and entry[1] > now:
+            return entry[0]
+        if system in _context_registering:
+            if entry and entry[0] and entry[1] + _CONTEXT_RENEW_MARGIN > now:
+                return entry[0]
+            return None
+        _context_registering.add(system)
+
+    name = None
+    try:
+        resp = _post(f"{API_BASE}/v1beta/cachedContents", json.dumps({
+            "model": f"models/{MODEL}",
+            "systemInstruction": {"parts": [{"text": system}]},
+            "ttl": f"{CONTEXT_CACHE_TTL}s",
+        }))
+        resp.raise_for_status()
+        name = resp.json().get("name")
+    except Exception:
+        pass
+    finally:
+        with _context_lock:
+            _context_handles[system] = (name, now + max(CONTEXT_CACHE_TTL - _CONTEXT_RENEW_MARGIN, 1))
+            _context_registering.discard(system)
+    return name
+
+def _request_body(prompt_payload: dict) -> str:
+    # Static system block first (systemInstruction), per-request text last, so the
+    # shared prefix is byte-identical across requests with the same profile.
+    body = {}
+    handle = _cached_context(prompt_payload["system"]) if CONTEXT_CACHE and API_KEY else None
+    if handle:
+        body["cachedContent"] = handle
+    else:
+        body["systemInstruction"] = {"parts": [{"text": prompt_payload["system"]}]}
+    body["contents"] = [
+        {"role":"user","parts":[
+            {"text": prompt_payload["user"]}
+            # If using images via URLs, adapt to the correct API format here.
+        ]}
+    ]
+    return json.dumps(body)
+
+def _extract_text(data: dict) -> str:
+    return (
+        data.get("candidates",[{}])[0]
+            .get("content",{})
+            .get("parts",[{}])[0]
+            .get("text","")
+    )
+
+def _post(url: str, body: str):
+    if isinstance(_session, requests.Session):
+        return _session.post(url, data=body, timeout=TIMEOUT)
+    return _session.post(url, content=body, timeout=TIMEOUT)  # httpx
+
+def warm_up() -> None:
+    """
+    Open a pooled connection ahead of the first real request. Failures are ignored.
+    """
+    if not API_KEY:
+        return
+    try:
+        _session.get(f"{API_BASE}/v1beta/models/{MODEL}", timeout=TIMEOUT)
+    except Exception:
+        pass
+
+PLACEHOLDER_HTML = (
+    "<div>"
+    "<h2>Summary</h2>"
+    "<ul><li>Placeholder output (no GEMINI_API_KEY set)</li></ul>"
+    "<h3>Main Points</h3>"
+    "<ul><li>Bullet 1</li><li>Bullet 2</li></ul>"
+    "</div>"
+)
+
 def call_gemini_multimodal(prompt_payload: dict) -> str:
     """
     Stub call: Replace with actual Gemini 1.5 Pro multimodal request.
@@ -19,38 +178,209 @@ def call_gemini_multimodal(prompt_payload: dict) -> str:
     """
     if not API_KEY:
         # For local dev without keys, return a placeholder
-        return (
-            "<div>"
-            "<h2>Summary</h2>"
-            "<ul><li>Placeholder output (no GEMINI_API_KEY set)</li></ul>"
-            "<h3>Main Points</h3>"
-            "<ul><li>Bullet 1</li><li>Bullet 2</li></ul>"
-            "</div>"
-        )
+        return PLACEHOLDER_HTML
+
+    if not breaker.allow():
+        raise GeminiError("circuit open")
+    started = time.monotonic()
+    try:
+        html = _call_hedged(prompt_payload) if HEDGE else _call_once(prompt_payload)
+    except GeminiError:
+        breaker.record(False, time.monotonic() - started)
+        raise
+    latency = time.monotonic() - started
+    breaker.record(True, latency)
+    latencies.add(latency)
+    return html
 
+def _call_once(prompt_payload: dict) -> str:
     try:
-        resp = requests.post(
-            f"https://generativeai.googleapis.com/v1beta/models/{MODEL}:generateContent",
+        resp = _post(_endpoint(), _request_body(prompt_payload))
+        resp.raise_for_status()
+        html = _extract_text(resp.json())
+        return html or "<div><p>(Empty model response)</p></div>"
+    except Exception as e:
+        raise GeminiError(str(e))
+
+def _run_into(future: Future, fn, *args) -> None:
+    try:
+        future.set_result(fn(*args))
+    except BaseException as e:
+        future.set_exception(e)
+
+def _submit_hedge(prompt_payload: dict):
+    """Start the hedge if a pool worker is free; None otherwise (the pool is saturated)."""
+    global _hedges_in_flight
+    with _hedge_lock:
+        if _hedges_in_flight >= POOL_SIZE:
+            hedged["skipped"] += 1
+            return None
+        _hedges_in_flight += 1
+        hedged["sent"] += 1
+
+    def run():
+        global _hedges_in_flight
+        try:
+            return _call_once(prompt_payload)
+        finally:
+            with _hedge_lock:
+                _hedges_in_flight -= 1
+    return _hedge_executor.submit(run)
+
+def _call_hedged(prompt_payload: dict) -> str:
+    """
+    Send a second identical request if the first hasn't answered by the p95 delay;
+    the first success wins. The loser runs to completion in the background.
+    The first attempt starts at once on its own thread (never queued, so the delay
+    measures the model, not the pool); the caller only waits on it.
+    """
+    first = Future()
+    threading.Thread(target=_run_into, args=(first, _call_once, prompt_payload),
+                     name="gemini-call", daemon=True).start()
+    done, _ = wait([first], timeout=_hedge_delay())
+    if done:
+        return first.result()
+
+    second = _submit_hedge(prompt_payload)
+    if second is None:
+        return first.result()
+    pending = {first, second}
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for fut in done:
+            try:
+                result = fut.result()
+            except GeminiError as e:
+                error = e
+                continue
+            if fut is second:
+                _count_hedge("won")
+            return result
+    raise error
+
+def _stream_lines(url: str, body: str):
+    if isinstance(_session, requests.Session):
+        with _session.post(url, data=body, timeout=TIMEOUT, stream=True) as resp:
+            resp.raise_for_status()
+            yield from resp.iter_lines(decode_unicode=True)
+    else:  # httpx
+        with _session.stream("POST", url, content=body, timeout=TIMEOUT) as resp:
+            resp.raise_for_status()
+            yield from resp.iter_lines()
+
+def stream_gemini_multimodal(prompt_payload: dict):
+    """
+    Streaming variant of call_gemini_multimodal (streamGenerateContent over SSE).
+    Yields raw HTML text deltas as the model produces them.
+    """
+    if not API_KEY:
+        # Split the placeholder so local dev exercises the incremental path
+        for i in range(0, len(PLACEHOLDER_HTML), 48):
+            yield PLACEHOLDER_HTML[i:i + 48]
+        return
+
+    if not breaker.allow():
+        raise GeminiError("circuit open")
+    started = time.monotonic()
+    ok = True
+    try:
+        for line in _stream_lines(f"{_endpoint('streamGenerateContent')}?alt=sse", _request_body(prompt_payload)):
+            if not line or not line.startswith("data:"):
+                continue
+            text = _extract_text(json.loads(line[5:].strip()))
+            if text:
+                yield text
+    except GeneratorExit:
+        raise  # client went away; not an upstream failure
+    except Exception as e:
+        ok = False
+        raise GeminiError(str(e))
+    finally:
+        # total stream time isn't a latency signal, only errors count
+        breaker.record(ok, 0.0 if ok else time.monotonic() - started)
+
+# ---- asyncio client (asgi_app.py) ----
+_async_client = None
+
+def _get_async_client():
+    global _async_client
+    if _async_client is None:
+        import httpx
+        _async_client = httpx.AsyncClient(
+            http2=USE_HTTP2,
             headers={"Content-Type": "application/json", "x-goog-api-key": API_KEY},
-            data=json.dumps({
-                "contents": [
-                    {"role":"system","parts":[{"text": prompt_payload["system"]}]},
-                    {"role":"user","parts":[
-                        {"text": prompt_payload["user"]}
-                        # If using images via URLs, adapt to the correct API format here.
-                    ]}
-                ]
-            }),
-            timeout=TIMEOUT
+            timeout=TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=ASYNC_MAX_CONNECTIONS,
+                max_keepalive_connections=min(ASYNC_MAX_CONNECTIONS, POOL_SIZE * 4),
+            ),
         )
+    return _async_client
+
+async def acall_gemini_multimodal(prompt_payload: dict) -> str:
+    """
+    Async twin of call_gemini_multimodal; one event loop can hold hundreds of these in flight.
+    """
+    if not API_KEY:
+        return PLACEHOLDER_HTML
+
+    if not breaker.allow():
+        raise GeminiError("circuit open")
+    started = time.monotonic()
+    try:
+        html = await (_acall_hedged(prompt_payload) if HEDGE else _acall_once(prompt_payload))
+    except GeminiError:
+        breaker.record(False, time.monotonic() - started)
+        raise
+    latency = time.monotonic() - started
+    breaker.record(True, latency)
+    latencies.add(latency)
+    return html
+
+async def _acall_once(prompt_payload: dict) -> str:
+    try:
+        # Context-handle registration is a blocking call; keep it off the loop
+        body = await asyncio.to_thread(_request_body, prompt_payload) if CONTEXT_CACHE else _request_body(prompt_payload)
+        resp = await _get_async_client().post(_endpoint(), content=body)
         resp.raise_for_status()
-        data = resp.json()
-        html = (
-            data.get("candidates",[{}])[0]
-                .get("content",{})
-                .get("parts",[{}])[0]
-                .get("text","")
-        )
+        html = _extract_text(resp.json())
         return html or "<div><p>(Empty model response)</p></div>"
     except Exception as e:
         raise GeminiError(str(e))
+
+async def _acall_hedged(prompt_payload: dict) -> str:
+    first = asyncio.ensure_future(_acall_once(prompt_payload))
+    done, _ = await asyncio.wait({first}, timeout=_hedge_delay())
+    if done:
+        return first.result()
+
+    _count_hedge("sent")
+    second = asyncio.ensure_future(_acall_once(prompt_payload))
+    pending = {first, second}
+    error = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is not None:
+                    error = task.exception()
+                    continue
+                if task is second:
+                    _count_hedge("won")
+                return task.result()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
+
+def stats() -> dict:
+    with _hedge_lock:
+        hedge_stats = dict(hedged)
+    return {"breaker": breaker.stats(), "hedged": hedge_stats, "p95_sec": latencies.percentile(0.95, default=0.0)}
+
+async def aclose() -> None:
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
@@ -0,0 +1,99 @@
+import os
+import html as html_lib
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple
+
+import bleach
+
+from cache import ResponseCache, make_key
+from gemini_client import call_gemini_multimodal, GeminiError, MODEL
+from prompts import build_chunk_prompt, build_summary_prompt, chunk_text_budget
+from utils import split_text, sanitize_html, MAX_TEXT
+
+CHUNK_TOKENS = int(os.getenv("LONG_DOC_CHUNK_TOKENS", "4000"))
+# Chunks grow up to this size when a page won't fit in MAX_CHUNKS at CHUNK_TOKENS;
+# never past what a chunk prompt can carry within PROMPT_MAX_INPUT_TOKENS
+MAX_CHUNK_TOKENS = min(int(os.getenv("LONG_DOC_MAX_CHUNK_TOKENS", "12000")), chunk_text_budget())
+MAX_CHUNKS = int(os.getenv("LONG_DOC_MAX_CHUNKS", "24"))
+CONCURRENCY = int(os.getenv("LONG_DOC_CONCURRENCY", "4"))
+
+# Shared across requests so total fan-out to the model stays bounded
+_executor = ThreadPoolExecutor(max_workers=CONCURRENCY, thread_name_prefix="longdoc")
+
+def _plain_text(fragment: str) -> str:
+    return bleach.clean(fragment, tags=set(), strip=True)
+
+def _split_page(page_text: str) -> List[str]:
+    """Chunks for the page, enlarged (up to MAX_CHUNK_TOKENS) so the whole page fits in MAX_CHUNKS if it can."""
+    tokens = min(CHUNK_TOKENS, MAX_CHUNK_TOKENS)
+    chunks = split_text(page_text, tokens)
+    while len(chunks) > MAX_CHUNKS and tokens < MAX_CHUNK_TOKENS:
+        tokens = min(MAX_CHUNK_TOKENS, max(tokens + 1, tokens * len(chunks) // MAX_CHUNKS))
+        chunks = split_text(page_text, tokens)
+    return chunks
+
+def _omitted_section(chunks: List[str]) -> str:
+    chars = sum(len(c) for c in chunks)
+    return (
+        "<section><h2>Remaining content omitted</h2>"
+        f"<p>This page was too long to adapt in full; the last {len(chunks)} sections "
+        f"(about {chars} characters) were left out.</p></section>"
+    )
+
+def _adapt_chunk(origin: str, profile: str, chunk: str, images: List[str],
+                 index: int, total: int, cache: ResponseCache) -> Tuple[str, bool]:
+    # Keyed on the chunk itself, so editing one section only re-runs that section
+    key = make_key("chunk", profile, chunk, images, origin, MODEL)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached, True
+    try:
+        raw = call_gemini_multimodal(build_chunk_prompt(origin, profile, chunk, images, index, total))
+    except GeminiError:
+        return f"<section><p>{html_lib.escape(chunk, quote=False)}</p></section>", False
+    safe = sanitize_html(raw)
+    cache.set(key, safe)
+    return safe, True
+
+def _summarize(origin: str, profile: str, sections: List[str], cache: ResponseCache) -> Tuple[str, bool]:
+    sections_text = " ".join(_plain_text(s) for s in sections)[:MAX_TEXT]
+    key = make_key("summary", profile, sections_text, origin, MODEL)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached, True
+    try:
+        raw = call_gemini_multimodal(build_summary_prompt(origin, profile, sections_text))
+    except GeminiError:
+        return "<h2>Summary</h2><p>Summary unavailable; the adapted sections follow.</p>", False
+    safe = sanitize_html(raw)
+    cache.set(key, safe)
+    return safe, True
+
+def adapt_long_document(origin: str, profile: str, page_text: str, image_urls: List[str],
+                        cache: ResponseCache) -> Tuple[str, bool]:
+    """
+    Map-reduce adaptation: split on heading/sentence boundaries, adapt chunks in
+    parallel, then prepend a summary. Returns (sanitized html, complete); sections
+    that failed upstream fall back to their escaped source text and complete=False.
+    A page too long for MAX_CHUNKS chunks even at MAX_CHUNK_TOKENS gets a visible
+    "remaining content omitted" section and complete=False.
+    """
+    chunks = _split_page(page_text)
+    chunks, omitted = chunks[:MAX_CHUNKS], chunks[MAX_CHUNKS:]
+    if not chunks:
+        raise GeminiError("empty page text")
+    total = len(chunks)
+    futures = [
+        _executor.submit(_adapt_chunk, origin, profile, chunk,
+                         image_urls if i == 0 else [], i + 1, total, cache)
+        for i, chunk in enumerate(chunks)
+    ]
+    results = [f.result() for f in futures]
+    if not any(ok for _, ok in results):
+        raise GeminiError("all sections failed")
+
+    sections = [html for html, _ in results]
+    summary, summary_ok = _summarize(origin, profile, sections, cache)
+    complete = summary_ok and all(ok for _, ok in results) and not omitted
+    tail = _omitted_section(omitted) if omitted else ""
+    return "<div>" + summary + "".join(sections) + tail + "</div>", complete
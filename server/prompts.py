@@ -1,18 +1,44 @@
 from textwrap import dedent
+from types import MappingProxyType
 
-def build_multimodal_prompt(origin: str, profile: str, page_text: str, image_urls: list[str]) -> dict:
-    """
-    Returns a Gemini messages/payload structure (model-dependent).
-    Keep it simple; Person B can adapt to actual SDK call.
-    """
-    system = dedent(f"""
+from budget import allocate, fit_page_text, PROMPT_MAX_INPUT_TOKENS
+
+# Supported reader profiles. Add a profile here and every system block below picks it up.
+PROFILES = ("ADHD", "DYSLEXIA")
+
+# System instructions depend only on the profile, so they're built once at import
+# and sent byte-identical on every request: the static prefix that upstream
+# prefix/context caching can reuse. Per-request content only goes in the user turn.
+SYSTEM_PROMPTS = MappingProxyType({
+    profile: dedent(f"""
     You are an AI Accessibility Agent. Transform the provided webpage content into a single, accessible HTML fragment for a user with [Profile: {profile}].
     Make the content scannable: top summary, clear headings, bullets, short sentences, bold key phrases.
     For each image URL, generate a concise caption (≤2 sentences) and weave it near where it appeared.
     Return ONLY the final HTML fragment. No extra commentary, no <script> or inline event handlers.
     """)
+    for profile in PROFILES
+})
+
+CHUNK_SYSTEM_PROMPTS = MappingProxyType({
+    profile: dedent(f"""
+    You are an AI Accessibility Agent. Transform ONE section of a longer webpage into an accessible HTML fragment for a user with [Profile: {profile}].
+    The [PART] line says which section this is. Do NOT write an overall summary; use clear headings, bullets, short sentences, bold key phrases.
+    For each image URL, generate a concise caption (≤2 sentences) and weave it near where it appeared.
+    Return ONLY a single <section> HTML fragment. No extra commentary, no <script> or inline event handlers.
+    """)
+    for profile in PROFILES
+})
+
+SUMMARY_SYSTEM_PROMPTS = MappingProxyType({
+    profile: dedent(f"""
+    You are an AI Accessibility Agent writing the top summary of a long webpage for a user with [Profile: {profile}].
+    Return ONLY <h2>Summary</h2> followed by one <ul> of 3-7 short bullets with bold key phrases. No <script> or inline event handlers.
+    """)
+    for profile in PROFILES
+})
 
-    user_text = dedent(f"""
+# Dedented once; page text is substituted afterwards so its own line breaks don't defeat dedent
+_USER_TEMPLATE = dedent("""
     [ORIGIN]: {origin}
     [PROFILE]: {profile}
 
@@ -20,12 +46,90 @@ def build_multimodal_prompt(origin: str, profile: str, page_text: str, image_url
     {page_text}
 
     [IMAGES]:
-    {chr(10).join(f"- {u}" for u in image_urls)}
+    {images}
     """)
 
+_CHUNK_USER_TEMPLATE = dedent("""
+    [ORIGIN]: {origin}
+    [PROFILE]: {profile}
+    [PART]: {index}/{total}
+
+    [TEXT]:
+    {chunk_text}
+
+    [IMAGES]:
+    {images}
+    """)
+
+_SUMMARY_USER_TEMPLATE = dedent("""
+    [ORIGIN]: {origin}
+
+    [ADAPTED SECTIONS]:
+    {sections_text}
+    """)
+
+def build_multimodal_prompt(origin: str, profile: str, page_text: str, image_urls: list[str],
+                            max_input_tokens: int = PROMPT_MAX_INPUT_TOKENS) -> dict:
+    """
+    Returns a Gemini messages/payload structure (model-dependent).
+    Keep it simple; Person B can adapt to actual SDK call.
+    Page text and images are trimmed to fit max_input_tokens (see budget.py).
+    """
+    system = SYSTEM_PROMPTS[profile]
+
+    text_budget, image_urls = allocate(system, image_urls, max_input_tokens)
+    user_text = _USER_TEMPLATE.format(
+        origin=origin,
+        profile=profile,
+        page_text=fit_page_text(page_text, text_budget),
+        images=chr(10).join(f"- {u}" for u in image_urls),
+    )
+
     # Generic structure compatible with many chat APIs:
     return {
         "system": system,
         "user": user_text,
         "images": image_urls,  # your client decides how to pass these
     }
+
+def chunk_text_budget(max_input_tokens: int = PROMPT_MAX_INPUT_TOKENS) -> int:
+    """Largest section (in tokens) a chunk prompt can carry for every profile; longdoc sizes chunks to it."""
+    return min(allocate(CHUNK_SYSTEM_PROMPTS[p], [], max_input_tokens)[0] for p in PROFILES)
+
+def build_chunk_prompt(origin: str, profile: str, chunk_text: str, image_urls: list[str], index: int, total: int,
+                       max_input_tokens: int = PROMPT_MAX_INPUT_TOKENS) -> dict:
+    """
+    Map step for long pages: adapt one section; the merged document gets its summary separately.
+    Budgeted like build_multimodal_prompt, except the section text comes first (chunks are
+    sized to fit, so trimming is only a safety net) and images get what it leaves.
+    """
+    system = CHUNK_SYSTEM_PROMPTS[profile]
+    text_budget, _ = allocate(system, [], max_input_tokens)
+    chunk_text = fit_page_text(chunk_text, text_budget)
+    _, image_urls = allocate(system + chunk_text, image_urls, max_input_tokens)
+    return {
+        "system": system,
+        "user": _CHUNK_USER_TEMPLATE.format(
+            origin=origin,
+            profile=profile,
+            index=index,
+            total=total,
+            chunk_text=chunk_text,
+            images=chr(10).join(f"- {u}" for u in image_urls),
+        ),
+        "images": image_urls,
+    }
+
+def build_summary_prompt(origin: str, profile: str, sections_text: str,
+                         max_input_tokens: int = PROMPT_MAX_INPUT_TOKENS) -> dict:
+    """
+    Reduce step for long pages: a top summary over the already-adapted sections,
+    trimmed to max_input_tokens.
+    """
+    system = SUMMARY_SYSTEM_PROMPTS[profile]
+    text_budget, _ = allocate(system, [], max_input_tokens)
+    return {
+        "system": system,
+        "user": _SUMMARY_USER_TEMPLATE.format(origin=origin, sections_text=fit_page_text(sections_text, text_budget)),
+        "images": [],
+    }
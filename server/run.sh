@@ -9,4 +9,9 @@ pip install -r requirements.txt
 # Load env
 if [ -f .env ]; then export $(grep -v '^#' .env | xargs); fi
 
+if [ "${ASGI:-false}" = "true" ]; then
+  # asyncio serving mode: one process holds many in-flight model calls
+  exec uvicorn asgi_app:app --host "${HOST:-0.0.0.0}" --port "${PORT:-5000}"
+fi
+
 python app.py
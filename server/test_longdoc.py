@@ -0,0 +1,29 @@
+import longdoc
+from budget import IMAGE_TOKENS, PROMPT_MAX_INPUT_TOKENS
+from prompts import PROFILES, build_chunk_prompt, build_summary_prompt
+from utils import estimate_tokens
+
+def _prompt_tokens(payload: dict) -> int:
+    return estimate_tokens(payload["system"]) + estimate_tokens(payload["user"]) + len(payload["images"]) * IMAGE_TOKENS
+
+def test_grown_chunks_fit_the_prompt_budget_untrimmed():
+    # No headings, so chunks grow all the way to MAX_CHUNK_TOKENS
+    page = "\n\n".join(f"Sentence number {i} is here. " * 30 for i in range(1500))
+    chunks = longdoc._split_page(page)
+    assert len(chunks) > 1
+    for profile in PROFILES:
+        for i, chunk in enumerate(chunks):
+            payload = build_chunk_prompt("https://example.com", profile, chunk, [], i + 1, len(chunks))
+            assert chunk in payload["user"]
+            assert _prompt_tokens(payload) <= PROMPT_MAX_INPUT_TOKENS
+
+def test_first_chunk_images_only_get_what_the_text_leaves():
+    chunk = longdoc._split_page("Some words here. " * 60_000)[0]
+    images = [f"https://example.com/{i}.png" for i in range(10)]
+    payload = build_chunk_prompt("https://example.com", PROFILES[0], chunk, images, 1, 2)
+    assert chunk in payload["user"]
+    assert _prompt_tokens(payload) <= PROMPT_MAX_INPUT_TOKENS
+
+def test_summary_prompt_is_budgeted():
+    payload = build_summary_prompt("https://example.com", PROFILES[0], "adapted section text " * 20_000)
+    assert _prompt_tokens(payload) <= PROMPT_MAX_INPUT_TOKENS
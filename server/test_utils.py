@@ -0,0 +1,38 @@
+import pytest
+
+import utils
+
+# The fast path must only skip bleach when bleach would return the input unchanged.
+MISNESTED = [
+    "<p><li>x</li></p>",
+    "<p><span><li>x</li></span></p>",
+    "<p><ul><li>x</li></ul></p>",
+    "<p><div>x</div></p>",
+    "<p><p>x</p></p>",
+    "<p><h2>x</h2></p>",
+    "<p>a<hr>b</p>",
+    "<h1><h2>x</h2></h1>",
+    "<a href=\"https://a.example\"><a href=\"https://b.example\">x</a></a>",
+    "<ul><li><li>x</li></li></ul>",
+    "<b><i>x</b></i>",
+    "<li><p>x</p></li>",
+    "<ul><li><p>x</p></li></ul>",
+]
+
+CANONICAL = [
+    "<p>Plain &amp; simple</p>",
+    "<section><h2>Title</h2><p>Body <strong>bold</strong></p></section>",
+    "<ul><li>one</li><li>two <a href=\"https://example.com\">link</a></li></ul>",
+    "<div data-xpath=\"/html/body\"><img src=\"https://example.com/a.png\" alt=\"A\"></div>",
+]
+
+@pytest.mark.parametrize("html", MISNESTED + CANONICAL)
+def test_fast_path_matches_cleaner(html):
+    expected = utils._cleaner().clean(html)
+    assert utils.sanitize_html(html) == expected
+    if utils._is_canonical(html):
+        assert expected == html
+
+@pytest.mark.parametrize("html", CANONICAL)
+def test_canonical_fragments_take_fast_path(html):
+    assert utils._is_canonical(html)
@@ -1,5 +1,6 @@
 import os
 import re
+import threading
 from typing import List
 import bleach
 
@@ -22,12 +23,71 @@ ALLOWED_ATTRS = {
     "div": ["data-xpath"],
 }
 ALLOWED_PROTOCOLS = ["http","https","mailto"]
+SANITIZE_FAST_PATH = os.getenv("SANITIZE_FAST_PATH", "true").lower() == "true"
+
+# Cleaner builds its html5lib parser/walker/serializer once; instances aren't
+# thread-safe, so keep one per thread.
+_cleaners = threading.local()
+
+def _cleaner() -> bleach.sanitizer.Cleaner:
+    cleaner = getattr(_cleaners, "cleaner", None)
+    if cleaner is None:
+        cleaner = _cleaners.cleaner = bleach.sanitizer.Cleaner(
+            tags=ALLOWED_TAGS,
+            attributes=ALLOWED_ATTRS,
+            protocols=ALLOWED_PROTOCOLS,
+            strip=True
+        )
+    return cleaner
+
+def normalize_text(s: str) -> str:
+    return re.sub(r"\s+", " ", s or "").strip()
 
 def clamp_text(s: str) -> str:
     if not s:
         return ""
-    s = re.sub(r"\s+", " ", s).strip()
-    return s[:MAX_TEXT]
+    return normalize_text(s)[:MAX_TEXT]
+
+def estimate_tokens(s: str) -> int:
+    # ~4 chars/token for ASCII prose; non-ASCII (accents, CJK) tokenizes far denser
+    extra = len(s.encode("utf-8")) - len(s)
+    return (len(s) + 3) // 4 + extra // 2
+
+_PARAGRAPH_RE = re.compile(r"\n\s*\n")
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+
+def _looks_like_heading(p: str) -> bool:
+    return p.startswith("#") or (len(p) < 80 and not p.endswith((".", "!", "?", ":", ";", ",")))
+
+def split_text(s: str, max_tokens: int) -> List[str]:
+    """
+    Split page text into chunks of at most ~max_tokens, breaking on paragraph/heading
+    boundaries first, then sentences, and only hard-cutting a single oversized sentence.
+    """
+    budget = max(max_tokens * 4, 1)
+    pieces = []
+    for para in _PARAGRAPH_RE.split(s or ""):
+        para = normalize_text(para)
+        if not para:
+            continue
+        if len(para) <= budget:
+            pieces.append(para)
+            continue
+        for sent in _SENTENCE_RE.split(para):
+            pieces.extend(sent[i:i + budget] for i in range(0, len(sent), budget))
+
+    chunks, cur, size = [], [], 0
+    for piece in pieces:
+        full = size + len(piece) + 1 > budget
+        new_section = _looks_like_heading(piece) and size >= budget // 2
+        if cur and (full or new_section):
+            chunks.append(" ".join(cur))
+            cur, size = [], 0
+        cur.append(piece)
+        size += len(piece) + 1
+    if cur:
+        chunks.append(" ".join(cur))
+    return chunks
 
 def clamp_images(urls: List[str]) -> List[str]:
     seen = set()
@@ -43,11 +103,170 @@ def clamp_images(urls: List[str]) -> List[str]:
             break
     return out
 
+# ---- Fast path: fragments already in bleach's canonical output form ----
+_FAST_TOKEN_RE = re.compile(r'<(/?)([a-z][a-z0-9]*)((?: [a-z-]+="[^"<>&]*")*)>|([^<]+)')
+_FAST_ATTR_RE = re.compile(r' ([a-z-]+)="([^"<>&]*)"')
+_FAST_BAD_TEXT_RE = re.compile(r">|&(?!amp;|lt;|gt;)|[\x00-\x08\x0b-\x1f\x7f]")
+_FAST_URI_ATTRS = {"href", "src"}
+_FAST_URI_PREFIXES = ("http://", "https://", "mailto:")
+_FAST_VOID = {"br", "hr", "img"}
+_FAST_HEADINGS = {"h1","h2","h3","h4","h5","h6"}
+# Opening any of these while a <p> is open makes html5lib close the <p>
+_FAST_CLOSES_P = {"article","aside","blockquote","div","footer","header","hr","li","ol","p","section","ul"} | _FAST_HEADINGS
+
+def _is_canonical(html: str) -> bool:
+    """
+    Conservative pre-scan: True only if bleach would return `html` unchanged
+    (allow-listed lowercase tags, double-quoted allow-listed attributes, balanced
+    nesting html5lib won't restructure, escaped text). Anything else -> full parse.
+    """
+    stack: List[str] = []
+    pos = 0
+    for m in _FAST_TOKEN_RE.finditer(html):
+        if m.start() != pos:
+            return False
+        pos = m.end()
+        text = m.group(4)
+        if text is not None:
+            if _FAST_BAD_TEXT_RE.search(text):
+                return False
+            continue
+        closing, tag, attrs = m.group(1), m.group(2), m.group(3)
+        if tag not in ALLOWED_TAGS:
+            return False
+        if closing:
+            if attrs or not stack or stack.pop() != tag:
+                return False
+            continue
+        allowed = ALLOWED_ATTRS.get(tag, ())
+        seen = set()
+        for name, value in _FAST_ATTR_RE.findall(attrs):
+            if name not in allowed or name in seen:
+                return False
+            if name in _FAST_URI_ATTRS and not value.startswith(_FAST_URI_PREFIXES):
+                return False
+            seen.add(name)
+        if "p" in stack and tag in _FAST_CLOSES_P:
+            return False
+        if tag in _FAST_HEADINGS and stack and stack[-1] in _FAST_HEADINGS:
+            return False
+        if tag == "a" and "a" in stack:
+            return False
+        if tag == "li":
+            for open_tag in reversed(stack):
+                if open_tag == "li":
+                    return False
+                if open_tag in ("ul", "ol"):
+                    break
+        if tag not in _FAST_VOID:
+            stack.append(tag)
+    return pos == len(html) and not stack
+
 def sanitize_html(html: str) -> str:
-    return bleach.clean(
-        html or "",
-        tags=ALLOWED_TAGS,
-        attributes=ALLOWED_ATTRS,
-        protocols=ALLOWED_PROTOCOLS,
-        strip=True
-    )
+    html = html or ""
+    if SANITIZE_FAST_PATH and _is_canonical(html):
+        return html
+    return _cleaner().clean(html)
+
+# ---- Incremental sanitizing (streaming /adapt-page) ----
+_TAG_RE = re.compile(r"""<(/?)([a-zA-Z][a-zA-Z0-9-]*)(?:"[^"]*"|'[^']*'|[^'">])*?(/?)>""")
+_VOID_TAGS = {"area","base","br","col","embed","hr","img","input","link","meta","source","track","wbr"}
+_RAW_TEXT_TAGS = {"script","style","textarea","title"}
+_WRAPPER_TAGS = {"div","section","article","main"}
+
+class IncrementalSanitizer:
+    """
+    Sanitizes a streamed HTML fragment one completed element at a time.
+
+    Each top-level element (or each child of a single leading wrapper such as
+    <div>) goes through sanitize_html as soon as its closing tag arrives.
+    Anything the scanner can't balance (or raw-text tags like <script>) stays
+    buffered until close(), so the worst case degrades to sanitizing the
+    remainder in one pass.
+    """
+    def __init__(self):
+        self._buf = ""
+        self._scan = 0
+        self._stack: List[str] = []
+        self._base = 0
+        self._wrapper_raw = ""
+        self._wrapper_open = ""
+        self._wrapper_close = ""
+        self._started = False
+        self._buffer_rest = False
+
+    def feed(self, chunk: str) -> str:
+        self._buf += chunk or ""
+        out = []
+        while not self._buffer_rest:
+            i = self._buf.find("<", self._scan)
+            if i < 0:
+                self._scan = len(self._buf)
+                break
+            if self._buf.startswith("<!--", i):
+                end = self._buf.find("-->", i)
+                if end < 0:
+                    break
+                self._scan = end + 3
+                continue
+            m = _TAG_RE.match(self._buf, i)
+            if not m:
+                if self._buf.find(">", i) < 0:
+                    break  # tag still arriving
+                self._scan = i + 1
+                continue
+            closing, tag, self_closing = m.group(1), m.group(2).lower(), m.group(3)
+            end = m.end()
+
+            if not closing and not self._started and not self._stack \
+                    and tag in _WRAPPER_TAGS and not self._buf[:i].strip():
+                # Descend into the wrapper so its children can flush one by one
+                self._started = True
+                self._wrapper_raw = self._buf[i:end]
+                wrapped = sanitize_html(self._wrapper_raw + f"</{tag}>")
+                if wrapped.endswith(f"</{tag}>"):
+                    self._wrapper_open = wrapped[:-len(f"</{tag}>")]
+                    self._wrapper_close = f"</{tag}>"
+                else:
+                    self._wrapper_open = wrapped
+                out.append(self._wrapper_open)
+                self._stack = [tag]
+                self._base = 1
+                self._buf, self._scan = self._buf[end:], 0
+                continue
+            self._started = True
+
+            if closing:
+                if tag in self._stack:
+                    while self._stack.pop() != tag:
+                        pass
+                if self._base and not self._stack:
+                    # Wrapper closed: flush what's left inside, then the close tag
+                    out.append(sanitize_html(self._buf[:i]))
+                    out.append(self._wrapper_close)
+                    self._base = 0
+                    self._buf, self._scan = self._buf[end:], 0
+                    continue
+            elif tag in _RAW_TEXT_TAGS:
+                # bleach re-parses stripped raw text as markup; only a single pass matches it
+                self._buffer_rest = True
+                break
+            elif tag not in _VOID_TAGS and not self_closing:
+                self._stack.append(tag)
+
+            self._scan = end
+            if len(self._stack) == self._base:
+                out.append(sanitize_html(self._buf[:end]))
+                self._buf, self._scan = self._buf[end:], 0
+        return "".join(out)
+
+    def close(self) -> str:
+        buf, self._buf, self._scan = self._buf, "", 0
+        if not self._base:
+            return sanitize_html(buf) if buf else ""
+        # Still inside the wrapper: re-parse with its open tag so implicit closing matches a single pass
+        self._base = 0
+        full = sanitize_html(self._wrapper_raw + buf)
+        if full.startswith(self._wrapper_open):
+            return full[len(self._wrapper_open):]
+        return sanitize_html(buf) + self._wrapper_close